@@ -7,10 +7,61 @@
 # - Funktionenkosten (H1 bars; H2 drilldown colored by H1)
 # - Technik Bewertung (Tech lines; Costs lines under it)
 # - Top Kostenabweichung (bar + ranked table)
+# - Server-wide parse cache (content hash, shared across sessions, single-flight)
+# - Optional on-disk SQLite cache shared by several server processes (FKA_DISK_CACHE)
+# - Template fingerprints (sheet names + header band) -> cached extraction plans
+# - Parser-strategy registry: fixed layout (v10.5), header heuristic (v07.3),
+#   column detection (v03) - cheap pre-checks first, winner recorded per template
+# - Sheet-level change detection: worksheet parts hashed individually, unchanged
+#   sheets reuse their cached parse results
+# - Fast path: header band and tech columns streamed straight from the worksheet XML
+#   (no openpyxl object model), shared strings resolved only where referenced
+# - Excel reader picks calamine when installed (python-calamine), else openpyxl
+# - Formula fallback: cells without cached values (files saved by non-Excel tools)
+#   are evaluated (SUM/PRODUCT/..., + - * / ^ %, cell/range/cross-sheet refs)
+# - Uploads spooled once to a temp dir (FKA_SPOOL_DIR), parsed from memory-mapped files
+# - Bulk upload: a .zip of workbooks is streamed member by member into a parallel parse pool
+# - Two-phase ingestion: quick scan (sheets, SLAVE_START metadata, H1 header row) lists all
+#   products at once; full parsing continues in the background and fills in results
+# - Lazy products: with many uploads (FKA_LAZY_FROM) a product is only parsed when a view
+#   first touches its data; the portfolio view loads the rest in parallel on request
+# - Live ingestion progress (files done, running file, ETA) with cancel/resume per session
+# - Dataflow memo: derived tables and figures declare their inputs and are only rebuilt
+#   when one of them (product, widget value, upstream node) changed
+# - Generic layout: cost columns detected on the whole frame at once, manual override
+# - H1 tech scores (mean / weighted / normalized) for the whole portfolio via segment sums
+# - What-if: H1/H2 weights and H2 costs overridden per product as sparse deltas; only the
+#   touched H1 aggregates, that product's tech scores and its deviations are recomputed
+# - Named scenarios stored as sparse deltas over the base portfolio, compared side by side
+# - Monte Carlo: H2 costs / tech scores drawn (± % uniform or triangular), vectorized over
+#   all products; P10/P50/P90 for H1 costs, overall scores and deviation ranks (seeded)
+# - Target costing: cost share vs weight share and value index per H1/H2 for the whole
+#   portfolio, computed right after ingestion; Zielkostenkontrolldiagramm with zone q
+# - Best-in-class per H2: cheapest cost at TechScore >= threshold, median, gap per product;
+#   threshold changes are a searchsorted on cached sorted arrays
+# - Pareto front cost vs weighted tech score (sort + running max) per product and per H1
 #
 # Run: streamlit run app_v10_5.py
 
+import copy
+import hashlib
+import importlib.util
+import io
+import mmap
+import os
+import pickle
+import posixpath
 import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from collections import OrderedDict, defaultdict
+
 import numpy as np
 import pandas as pd
 import streamlit as st
@@ -18,6 +69,20 @@ import plotly.graph_objects as go
 
 st.set_page_config(page_title="EFESO – Functional Cost Analysis TOOLSET", layout="wide")
 VERSION = "v10.5"
+PARSE_CACHE_MB = int(os.environ.get("FKA_PARSE_CACHE_MB", "512"))
+DISK_CACHE = os.environ.get("FKA_DISK_CACHE", "")          # path to SQLite file; empty = off
+DISK_CACHE_TTL_H = float(os.environ.get("FKA_DISK_CACHE_TTL_H", "24"))
+DISK_CACHE_MB = int(os.environ.get("FKA_DISK_CACHE_MB", "2048"))
+CACHE_SCHEMA = 6   # bump when parse results change shape
+SPOOL_DIR = os.environ.get("FKA_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "fka_spool")
+SPOOL_TTL_H = float(os.environ.get("FKA_SPOOL_TTL_H", "6"))
+PARSE_WORKERS = int(os.environ.get("FKA_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+MAX_MEMBER_MB = int(os.environ.get("FKA_MAX_MEMBER_MB", "200"))   # per workbook inside a .zip
+LAZY_FROM = int(os.environ.get("FKA_LAZY_FROM", "20"))   # uploads from which parsing is on demand by default
+# fastest installed engine first; FKA_EXCEL_ENGINE=openpyxl forces the fallback
+EXCEL_ENGINES = [e for e in (os.environ.get("FKA_EXCEL_ENGINE", "calamine"), "openpyxl")
+                 if e == "openpyxl" or importlib.util.find_spec("python_calamine") is not None]
+EXCEL_ENGINES = list(dict.fromkeys(EXCEL_ENGINES))
 
 # ---------------- Helpers ----------------
 def _to_num(x):
@@ -47,15 +112,31 @@ def find_sheet(xls, must_all):
             return name
     return None
 
-def parse_cost_structure(xls):
-    sheet = find_sheet(xls, ["funktions", "kosten"]) or xls.sheet_names[0]
-    df = xls.parse(sheet, header=None, dtype=str).fillna("")
-    # Excel rows -> 0-based indices:
-    ROW_H1, ROW_H2 = 0, 1           # names
-    ROW_W1, ROW_W2 = 3, 4           # weights
-    ROW_C1, ROW_C2 = 6, 7           # costs
-    START_COL = 8                   # column I (0-based)
+# Excel rows -> 0-based indices:
+ROW_H1, ROW_H2 = 0, 1           # names
+ROW_W1, ROW_W2 = 3, 4           # weights
+ROW_C1, ROW_C2 = 6, 7           # costs
+START_COL = 8                   # column I (0-based)
+HEADER_ROWS = 8                 # header band = rows 1..8
+
+ROW_C_OLD = 4                   # v07.3 layout: H2 costs in row 5
+START_SHEET_HINTS = ["slave_start", "start"]   # metadata block (key/value in columns A/B)
+META_ROWS = 30
+
+def _label(v):
+    s = str(v).strip()
+    return "#" if s and not pd.isna(_to_num(s)) and not re.search(r"[A-Za-zÄÖÜäöüß]", s) else s
 
+def template_fingerprint(sheet_names, band):
+    """Identifies a template by its sheet names and header labels (incl. positions).
+    Numeric cells only count as '#', so products of one template share a fingerprint."""
+    h = hashlib.sha1()
+    h.update("\x1f".join(sheet_names).encode("utf-8"))
+    for row in band:
+        h.update(("\x1e" + "\x1f".join(_label(v) for v in row)).encode("utf-8"))
+    return h.hexdigest()
+
+def detect_fixed_plan(df, sheet):
     # find H1 block starts
     starts = []
     last = None
@@ -67,39 +148,347 @@ def parse_cost_structure(xls):
             last = lab
         else:
             last = None
-    if not starts:
-        return pd.DataFrame(columns=["H1","H1Weight","H1Cost"]), pd.DataFrame(columns=["H1","H2","H2Weight","H2Cost"])
 
-    blocks = []
+    h1_cols, h2_cols = [], []
     for i,s in enumerate(starts):
         e = (starts[i+1]-1) if i+1 < len(starts) else df.shape[1]-1
-        blocks.append((s,e))
-
-    h1_rows, h2_rows = [], []
-    for s,e in blocks:
         h1 = str(df.iat[ROW_H1, s]).strip()
-        if not h1: continue
-        h1_w = _to_pct(df.iat[ROW_W1, s])
-        h1_c = _to_num(df.iat[ROW_C1, s])
-        h1_rows.append([h1, h1_w, h1_c])
+        h1_cols.append([h1, s])
         for c in range(s, e+1):
             h2 = str(df.iat[ROW_H2, c]).strip()
-            if not h2: continue
-            h2_w = _to_pct(df.iat[ROW_W2, c])
-            h2_c = _to_num(df.iat[ROW_C2, c])
-            h2_rows.append([h1, h2, h2_w, h2_c])
+            if h2:
+                h2_cols.append([h1, h2, c])
+    return {"layout": "fixed", "sheet": sheet, "h1": h1_cols, "h2": h2_cols}
 
-    H1 = pd.DataFrame(h1_rows, columns=["H1","H1Weight","H1Cost"])
-    H2 = pd.DataFrame(h2_rows, columns=["H1","H2","H2Weight","H2Cost"])
+def extract_fixed(df, plan):
+    """Direct cell addressing along a known plan - no layout detection. A label may open
+    several H1 blocks; Block (the block's index in plan["h1"]) ties each H2 row to its H1 row."""
+    h1_rows = [[h1, _to_pct(df.iat[ROW_W1, c]), _to_num(df.iat[ROW_C1, c]), b] for b,(h1,c) in enumerate(plan["h1"])]
+    block = np.searchsorted([c for _,c in plan["h1"]], [c for _,_,c in plan["h2"]], side="right") - 1
+    h2_rows = [[h1, h2, _to_pct(df.iat[ROW_W2, c]), _to_num(df.iat[ROW_C2, c]), int(b)] for (h1,h2,c),b in zip(plan["h2"], block)]
+    H1 = pd.DataFrame(h1_rows, columns=["H1","H1Weight","H1Cost","Block"])
+    H2 = pd.DataFrame(h2_rows, columns=["H1","H2","H2Weight","H2Cost","Block"])
     if not H2.empty:
-        H2 = H2.groupby(["H1","H2"], as_index=False).agg({"H2Weight":"max","H2Cost":"max"})
+        H2 = H2.groupby(["H1","H2"], as_index=False).agg({"H2Weight":"max","H2Cost":"max","Block":"first"})
+    return H1, H2
+
+# ---------------- Parser strategies ----------------
+# v07.3 header heuristic (H1 row 1, H2 row 2, H2 costs row 5, weights from 'Funktionsbaum')
+# Header rows are classified as a whole: a label has >=3 characters and at least one letter.
+_LETTERS = re.compile(r"[A-Za-zÄÖÜäöüß]")
+
+def _row_str(df, r):
+    """Row r as stripped strings; 'nan'/'none' and missing rows count as empty."""
+    if r >= df.shape[0]:
+        return pd.Series([""] * df.shape[1], dtype=object)
+    s = df.iloc[r].astype(str).str.strip().reset_index(drop=True)
+    return s.mask(s.str.lower().isin(["nan", "none"]), "")
+
+def _label_mask(s):
+    return (s.str.len().ge(3) & s.str.contains(_LETTERS)).to_numpy()
+
+def _row_num(df, r, cols):
+    """Numbers in row r at cols; strings as German numbers ('1.234,5')."""
+    v = pd.Series(df.iloc[r].to_numpy()[cols], dtype=object)
+    is_str = v.map(type).eq(str)
+    out = pd.to_numeric(v.mask(is_str), errors="coerce").astype(float)
+    s = v[is_str].astype(str).str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    out[is_str] = pd.to_numeric(s, errors="coerce")
+    return out.to_numpy(dtype=float)
+
+def detect_heuristic_plan(df, sheet):
+    s1, s2 = _row_str(df, ROW_H1), _row_str(df, ROW_H2)
+    m1 = _label_mask(s1)
+    starts = np.flatnonzero(m1)                 # every H1 label opens a block up to the next one
+    owner = np.cumsum(m1) - 1                   # block index per column, -1 before the first
+    h2c = np.flatnonzero(_label_mask(s2) & (owner >= 0))
+    h1_cols = [[s1.iat[c], int(c)] for c in starts]
+    h2_cols = [[s1.iat[starts[owner[c]]], s2.iat[c], int(c)] for c in h2c]
+    return {"layout": "heuristic", "sheet": sheet, "h1": h1_cols, "h2": h2_cols}
+
+def extract_heuristic(df, plan):
+    cols = np.array([c for _,_,c in plan["h2"]], dtype=int)
+    vals = _row_num(df, ROW_C_OLD, cols) if ROW_C_OLD < df.shape[0] else np.full(len(cols), np.nan)
+    keep = ~np.isnan(vals) & (vals != 0.0)
+    rows_h2 = [[h1, h2, np.nan, float(v)] for (h1,h2,_), v, k in zip(plan["h2"], vals, keep) if k]
+    H2=pd.DataFrame(rows_h2, columns=["H1","H2","H2Weight","H2Cost"])
+    if not H2.empty:
+        H2=H2.groupby(["H1","H2"], as_index=False, sort=False).agg({"H2Weight":"max","H2Cost":"sum"})
+    H1=(H2.groupby("H1", as_index=False, sort=False)["H2Cost"].sum().rename(columns={"H2Cost":"H1Cost"}))
+    H1.insert(1, "H1Weight", np.nan)
+    return H1[["H1","H1Weight","H1Cost"]], H2
+
+def parse_funktionsbaum(xls):
+    """H1 weights from the 'Funktionsbaum' sheet: H1 names in row 3 (from column B),
+    weights in whichever of the next rows has the most numbers. The candidate
+    rows are converted once as a 2-D block."""
+    fb_sheet=find_sheet(xls, ["funktionsbaum"])
+    if fb_sheet is None:
+        return pd.DataFrame(columns=["H1","H1Weight"])
+    df=xls.parse(fb_sheet, header=None)
+    H1_ROW=2; FB_START=1
+    if df.shape[0] <= H1_ROW+2: return pd.DataFrame(columns=["H1","H1Weight"])
+    labels = _row_str(df, H1_ROW)
+    cols = np.flatnonzero(labels.ne("").to_numpy())
+    cols = cols[cols >= FB_START]
+    if not len(cols): return pd.DataFrame(columns=["H1","H1Weight"])
+
+    block = df.iloc[H1_ROW+2:H1_ROW+12].to_numpy()
+    flat = pd.Series(block.ravel()).astype(str).str.replace("%","",regex=False).str.replace(",",".",regex=False)
+    nums = pd.to_numeric(flat, errors="coerce").to_numpy(dtype=float).reshape(block.shape)
+    w = nums[np.argmax((~np.isnan(nums)).sum(axis=1)), cols]
+    ok = ~np.isnan(w)
+    return pd.DataFrame({"H1": labels.to_numpy()[cols[ok]], "H1Weight": np.where(w[ok] > 1, w[ok] / 100.0, w[ok])})
+
+# v03 column detection (one row per function, hierarchy columns + cost columns)
+_REAL_TYPES = [int, float, np.int64, np.float64]
+
+def _numeric_counts(df):
+    """Per column: cells that parse as numbers, strings read as German numbers
+    ("1.234,5"). Numeric columns are counted directly; the text cells of all other
+    columns are converted in one go, only strings that fail plain parsing get the
+    separator rewrite."""
+    is_num = np.array([pd.api.types.is_numeric_dtype(t) and not pd.api.types.is_bool_dtype(t) for t in df.dtypes], dtype=bool)
+    counts = np.zeros(df.shape[1], dtype=int)
+    if is_num.any():
+        counts[is_num] = df.iloc[:, is_num].notna().sum().to_numpy()
+    if not is_num.all():
+        block = df.iloc[:, ~is_num].to_numpy(dtype=object)
+        flat = pd.Series(block.ravel(), dtype=object)
+        kind = flat.map(type)
+        is_str = kind.eq(str)
+        num = pd.to_numeric(flat.where(is_str | kind.isin(_REAL_TYPES)), errors="coerce")
+        retry = is_str & num.isna()
+        num[retry] = pd.to_numeric(flat[retry].str.replace(".","", regex=False).str.replace(",",".", regex=False), errors="coerce")
+        counts[~is_num] = num.notna().to_numpy().reshape(block.shape).sum(axis=0)
+    return counts
+
+def detect_cost_columns(df):
+    """Regel 1: "€" in the column name or its header zone (first 8 rows).
+    Regel 2: mostly numeric after parsing (e.g. "33,85") and no heading text in the
+    header zone. Both rules are column reductions over whole-frame masks."""
+    cols = np.array(df.columns, dtype=object)
+    zone = df.head(8).to_numpy()
+    hz = pd.Series(zone.ravel(), dtype=object).astype(str)
+    euro = (np.array(["€" in str(c) for c in cols], dtype=bool)
+            | hz.str.contains("€", regex=False).to_numpy().reshape(zone.shape).any(axis=0))
+    text = hz.str.contains(r"[A-Za-z]", regex=True).to_numpy().reshape(zone.shape).any(axis=0)
+    rest = ~euro & ~text
+    numeric = np.zeros(len(cols), dtype=bool)
+    if rest.any():
+        numeric[rest] = _numeric_counts(df.iloc[:, rest]) >= max(3, int(0.5*len(df)))
+    return list(dict.fromkeys(list(cols[euro]) + list(cols[numeric])))
+
+def detect_hier_columns(df, cost_cols):
+    text_cols = [c for c in df.columns if c not in cost_cols and not pd.api.types.is_numeric_dtype(df[c])
+                 and df[c].astype(str).str.len().mean() > 2]
+    hier_cols = []
+    for key in ["H1","H2","H3","Hauptfunktion","Teilfunktion","Nebenfunktion","Unterfunktion"]:
+        for c in df.columns:
+            if key.lower() in str(c).lower() and c not in hier_cols and c not in cost_cols: hier_cols.append(c)
+    for c in text_cols:
+        if c not in hier_cols and len(hier_cols)<3: hier_cols.append(c)
+    return hier_cols[:3]
+
+def clean_numeric(series):
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    return pd.to_numeric(series.astype(str).str.replace(".","", regex=False).str.replace(",",".", regex=False), errors="coerce")
+
+def _segments(keys):
+    """Start index of every run of equal rows in a sorted 2-D key array."""
+    change = np.ones(len(keys), dtype=bool)
+    change[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    return np.flatnonzero(change)
+
+def rollup_costs(df, hier_cols, cost_cols):
+    """Costs per hierarchy level in one pass. Hierarchy keys are encoded once as
+    sorted codes (missing values last, like groupby(dropna=False)); rows are summed
+    into the finest groups and every coarser level is a segment sum of the level
+    below. Returns {"H1": .., "H2": .., ..., "tree": all levels in one frame
+    (Level, H1.., TotalCost), parents before their children}."""
+    row_cost = np.zeros(len(df))
+    for c in cost_cols:
+        v = clean_numeric(df[c]).to_numpy(dtype=float)
+        row_cost += np.where(np.isnan(v), 0.0, v)
+    enc = [pd.factorize(df[c], sort=True, use_na_sentinel=False) for c in hier_cols]
+    labels = [f"H{i+1}" for i in range(len(hier_cols))]
+    codes = np.column_stack([e[0] for e in enc]) if enc else np.zeros((len(df), 0), dtype=int)
+    order = np.lexsort(codes.T[::-1])
+    keys, sums = codes[order], row_cost[order]
+    res, tree_keys = {}, []
+    for lvl in range(len(hier_cols), 0, -1):
+        keys = keys[:, :lvl]
+        if len(keys):
+            starts = _segments(keys)
+            keys, sums = keys[starts], np.add.reduceat(sums, starts)
+        res[f"H{lvl}"] = pd.DataFrame({**{labels[i]: enc[i][1].take(keys[:, i]) for i in range(lvl)}, "TotalCost": sums})
+        tree_keys.append(np.pad(keys, ((0, 0), (0, len(hier_cols) - lvl)), constant_values=-1))
+    res = dict(reversed(res.items()))
+    if res:
+        # depth-first: a parent (-1 padded codes) sorts right before its children
+        tk = np.vstack(tree_keys[::-1])
+        tree = pd.concat([r.assign(Level=lvl) for lvl, r in enumerate(res.values(), 1)], ignore_index=True)
+        res["tree"] = tree.iloc[np.lexsort(tk.T[::-1])].reset_index(drop=True)[["Level", *labels, "TotalCost"]]
+    return res
+
+def detect_generic_plan(df, sheet):
+    cost_cols = detect_cost_columns(df)
+    return {"layout": "generic", "sheet": sheet, "cost_cols": cost_cols,
+            "hier_cols": detect_hier_columns(df, cost_cols)}
+
+def extract_generic(df, plan):
+    hier_cols, cost_cols = plan["hier_cols"], [c for c in plan["cost_cols"] if c in df.columns]
+    empty = pd.DataFrame(columns=["H1","H1Weight","H1Cost"]), pd.DataFrame(columns=["H1","H2","H2Weight","H2Cost"])
+    if len(hier_cols) < 2 or not cost_cols:
+        return empty
+    r = rollup_costs(df, hier_cols, cost_cols)
+    H1 = r["H1"].rename(columns={"TotalCost":"H1Cost"}); H1.insert(1, "H1Weight", np.nan)
+    H2 = r["H2"].rename(columns={"TotalCost":"H2Cost"}); H2.insert(2, "H2Weight", np.nan)
+    for D in (H1, H2):
+        for c in ("H1","H2"):
+            if c in D: D[c] = D[c].astype(str)
+    return H1, H2
+
+# Registry
+class Strategy:
+    """precheck(probe) -> bool, parse(xls, probe) -> (H1, H2); optional scan(probe)
+    lists the H1 names from the header band alone (quick scan)."""
+    def __init__(self, name, precheck, parse, scan=None):
+        self.name=name; self.precheck=precheck; self.parse=parse; self.scan=scan
+
+STRATEGIES = []   # tried in order, cheapest pre-check first
+
+def register_strategy(name, precheck, parse, scan=None):
+    STRATEGIES.append(Strategy(name, precheck, parse, scan))
+
+def _row_labels(band, r, c0=0):
+    return [v for v in (str(x).strip() for x in band.iloc[r, c0:]) if v]
+
+def _row_has_num(band, r, c0=0):
+    return any(not pd.isna(_to_num(v)) for v in _row_labels(band, r, c0))
+
+def _fixed_header(b):
+    """H1 labels from column I and none in B..H: the fixed layout, whose row 5 holds
+    H2 weights - not v07.3 costs. v07.3 labels start in column B; with a Funktionsbaum
+    sheet the workbook is v07.3 either way."""
+    m = _label_mask(_row_str(b, ROW_H1))
+    return bool(m[START_COL:].any()) and not m[1:START_COL].any()
+
+def _fixed_precheck(probe):
+    b = probe["band"]
+    return (b.shape[1] > START_COL and not probe["funktionsbaum"] and _fixed_header(b)
+            and bool(_row_labels(b, ROW_H2, START_COL))
+            and (_row_has_num(b, ROW_C1, START_COL) or _row_has_num(b, ROW_C2, START_COL)))
+
+def _fixed_scan(probe):
+    return list(dict.fromkeys(_row_labels(probe["band"], ROW_H1, START_COL)))
+
+def _fixed_parse(xls, probe):
+    plan = cached(f"plan:fixed:{probe['fp']}", lambda: detect_fixed_plan(probe["band"], probe["sheet"]))
+    return extract_fixed(probe["band"], plan)
+
+def _heuristic_precheck(probe):
+    b = probe["band"]
+    return ((probe["funktionsbaum"] or not _fixed_header(b))
+            and bool(_label_mask(_row_str(b, ROW_H1)).any()) and _row_has_num(b, ROW_C_OLD))
+
+def _heuristic_scan(probe):
+    s = _row_str(probe["band"], ROW_H1)
+    return list(dict.fromkeys(s[_label_mask(s)]))
+
+def _heuristic_parse(xls, probe):
+    plan = cached(f"plan:heuristic:{probe['fp']}", lambda: detect_heuristic_plan(probe["band"], probe["sheet"]))
+    H1, H2 = extract_heuristic(probe["band"], plan)
+    W = parse_funktionsbaum(xls).drop_duplicates("H1")
+    if not W.empty and not H1.empty:
+        H1 = H1.drop(columns="H1Weight").merge(W, on="H1", how="left")[["H1","H1Weight","H1Cost"]]
     return H1, H2
 
+def _generic_precheck(probe):
+    return len(_row_labels(probe["band"], 0)) >= 3
+
+def _generic_frame(xls, probe):
+    df = xls.parse(probe["sheet"])
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+def _generic_plan(xls, probe, df=None):
+    """Detected columns, cached per template fingerprint (so manual overrides never re-detect)."""
+    return cached(f"plan:generic:{probe['fp']}",
+                  lambda: detect_generic_plan(_generic_frame(xls, probe) if df is None else df, probe["sheet"]))
+
+def _generic_parse(xls, probe, cost_cols=None):
+    df = _generic_frame(xls, probe)
+    plan = _generic_plan(xls, probe, df)
+    if cost_cols is not None:
+        plan = {**plan, "cost_cols": list(cost_cols)}
+    return extract_generic(df, plan)
+
+register_strategy("fixed", _fixed_precheck, _fixed_parse, _fixed_scan)
+register_strategy("heuristic", _heuristic_precheck, _heuristic_parse, _heuristic_scan)
+register_strategy("generic", _generic_precheck, _generic_parse)
+
+def _valid(H1, H2):
+    return not H2.empty and (H2["H2Cost"].notna().any() or H1["H1Cost"].notna().any())
+
+def find_cost_sheet(xls):
+    return (find_sheet(xls, ["funktions", "kosten"])
+            or next((n for n in xls.sheet_names if "funktion" in n.lower() or "kosten" in n.lower()), None)
+            or xls.sheet_names[0])
+
+def probe_workbook(xls):
+    sheet = find_cost_sheet(xls)
+    band = read_sheet(xls, sheet, nrows=HEADER_ROWS).reindex(range(HEADER_ROWS), fill_value="")
+    fp = template_fingerprint(xls.sheet_names, band.iloc[[ROW_H1, ROW_H2]].values.tolist())
+    return {"sheet": sheet, "band": band, "fp": fp, "funktionsbaum": find_sheet(xls, ["funktionsbaum"]) is not None}
+
+def _first_valid(xls, probe):
+    """(name, H1, H2) of the first strategy whose pre-check passes and whose result is
+    valid, or None."""
+    for strat in STRATEGIES:
+        if strat.precheck(probe):
+            H1, H2 = strat.parse(xls, probe)
+            if _valid(H1, H2):
+                return strat.name, H1, H2
+    return None
+
+def parse_cost_structure(xls):
+    """Returns (layout, H1, H2). The winning strategy is remembered per template
+    fingerprint, so later files of that template go straight to it. Only winners are
+    remembered (an unfilled file must not decide for its template), and a remembered
+    winner that fails on this file falls back to the registry."""
+    probe = probe_workbook(xls)
+    by_name = {x.name: x for x in STRATEGIES}
+    found, ran = {}, []
+    def choose():
+        ran.append(True)
+        hit = _first_valid(xls, probe)
+        if hit is None:
+            raise LookupError("no strategy")     # errors are not cached
+        found[hit[0]] = hit[1:]
+        return hit[0]
+    try:
+        name = cached(f"strategy:{probe['fp']}", choose)
+    except LookupError:
+        name = ""
+    if name in found:
+        return name, *found[name]
+    strat = by_name.get(name)
+    if strat is not None and strat.precheck(probe):
+        H1, H2 = strat.parse(xls, probe)
+        if _valid(H1, H2):
+            return name, H1, H2
+    hit = None if ran else _first_valid(xls, probe)   # ran: this file already went through the registry
+    if hit is None:
+        return "", pd.DataFrame(columns=["H1","H1Weight","H1Cost"]), pd.DataFrame(columns=["H1","H2","H2Weight","H2Cost"])
+    return hit
+
 def parse_tech(xls):
     sheet = find_sheet(xls, ["techn", "bewert"])
     if sheet is None:
         return pd.DataFrame(columns=["H2","TechScore"])
-    df = xls.parse(sheet, header=None, dtype=str).fillna("")
+    df = read_sheet(xls, sheet, usecols=[1, 17])
     B, R = (1 if df.shape[1]>1 else None), (17 if df.shape[1]>17 else None)
     rows = []
     for i in range(df.shape[0]):
@@ -112,48 +501,1684 @@ def parse_tech(xls):
     return pd.DataFrame(rows, columns=["H2","TechScore"])
 
 class Product:
-    def __init__(self, name, H1, H2, TECH):
-        self.name=name; self.H1=H1; self.H2=H2; self.TECH=TECH
+    """H1/H2/TECH/layout of one workbook (path = spooled file). Placeholders get submit= instead, a callable
+    returning a future of parse_workbook's result: the parse starts on first access
+    (or start()) and runs at most once; future= attaches one that is already running.
+    A failed parse leaves empty frames and .error; wait() blocks until the data is there."""
+    def __init__(self, name, H1=None, H2=None, TECH=None, key=None, layout="", submit=None, future=None, path=None):
+        self.name=name; self.key=key; self.path=path; self.error=None
+        self._submit=submit; self._future=future
+        self._data = (H1, H2, TECH, layout) if submit is None else None
+
+    def start(self):
+        if self._data is None and (self._future is None or self._future.cancelled()):
+            self._future = self._submit()
+        return self
+
+    @property
+    def loaded(self):
+        return self._data is not None or (self._future is not None and self._future.done()
+                                          and not self._future.cancelled())
+
+    def wait(self):
+        """Starts the parse if needed and blocks until it finished (or failed)."""
+        if self._data is None:
+            try:
+                self._data = self.start()._future.result()
+            except Exception as e:
+                self.error = str(e)
+                self._data = (pd.DataFrame(columns=["H1","H1Weight","H1Cost"]),
+                              pd.DataFrame(columns=["H1","H2","H2Weight","H2Cost","TechScore"]),
+                              pd.DataFrame(columns=["H2","TechScore"]), "")
+        return self
+
+    def _get(self, i):
+        return self.wait()._data[i]
+
+    H1 = property(lambda self: self._get(0))
+    H2 = property(lambda self: self._get(1))
+    TECH = property(lambda self: self._get(2))
+    layout = property(lambda self: self._get(3))
+
+# ---------------- xlsx container ----------------
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+def _rels(zf, part):
+    """Relationship targets of a part, resolved to zip paths: {rId: (type, path)}."""
+    d, f = posixpath.split(part)
+    rel_path = posixpath.join(d, "_rels", f + ".rels")
+    if rel_path not in zf.NameToInfo:
+        return {}
+    out = {}
+    for r in ET.fromstring(zf.read(rel_path)).iter(f"{{{NS_PKG}}}Relationship"):
+        t = r.get("Target", "")
+        path = t.lstrip("/") if t.startswith("/") else posixpath.normpath(posixpath.join(d, t))
+        out[r.get("Id")] = (r.get("Type", "").rsplit("/", 1)[-1], path)
+    return out
+
+def _workbook_part(zf):
+    return next((p for t,p in _rels(zf, "").values() if t == "officeDocument"), "xl/workbook.xml")
+
+def workbook_parts(zf):
+    """Sheet name -> worksheet part, plus the sharedStrings part (key None)."""
+    wb_part = _workbook_part(zf)
+    rels = _rels(zf, wb_part)
+    parts = OrderedDict()
+    for sh in ET.fromstring(zf.read(wb_part)).iter(f"{{{NS_MAIN}}}sheet"):
+        rel = rels.get(sh.get(f"{{{NS_REL}}}id"))
+        if rel: parts[sh.get("name")] = rel[1]
+    parts[None] = next((p for t,p in rels.values() if t == "sharedStrings"), None)
+    return parts
+
+def part_hash(zf, part):
+    if not part or part not in zf.NameToInfo:
+        return ""
+    h = hashlib.sha1()
+    with zf.open(part) as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ExcelReader:
+    """pd.ExcelFile on the first engine of EXCEL_ENGINES that can read the file.
+    If the fast engine fails on open or on a sheet, openpyxl takes over."""
+    def __init__(self, src):
+        self.src = src
+        self._open(EXCEL_ENGINES)
+        self.sheet_names = self._xls.sheet_names
+
+    def _open(self, engines):
+        for i, engine in enumerate(engines):
+            try:
+                if hasattr(self.src, "seek"): self.src.seek(0)
+                self._xls = pd.ExcelFile(self.src, engine=engine); self.engine = engine
+                return
+            except Exception:
+                if i == len(engines)-1: raise
+
+    def parse(self, *args, **kwargs):
+        try:
+            return self._xls.parse(*args, **kwargs)
+        except Exception:
+            if self.engine == "openpyxl": raise
+            self._open(["openpyxl"])
+            return self._xls.parse(*args, **kwargs)
+
+# strings pandas reads as NaN by default
+NA_STRINGS = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+              "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+
+def _col_index(ref):
+    n = 0
+    for ch in ref:
+        if not ch.isalpha(): break
+        n = n*26 + (ord(ch.upper()) - 64)
+    return n - 1
+
+def _text(el):
+    """Text of an <si>/<is> element: plain <t> or concatenated rich-text runs (no phonetics)."""
+    t = el.find(f"{{{NS_MAIN}}}t")
+    if t is not None:
+        return t.text or ""
+    return "".join(t.text or "" for r in el.iterfind(f"{{{NS_MAIN}}}r") for t in r.iterfind(f"{{{NS_MAIN}}}t"))
+
+class SharedStrings:
+    """sharedStrings part resolved lazily: scanned only up to the highest index
+    requested, and only requested entries are kept."""
+    def __init__(self, zf, part):
+        self.zf = zf; self.part = part; self.values = {}
+
+    def resolve(self, indices):
+        need = set(indices) - self.values.keys()
+        if not need or not self.part:
+            return
+        last = max(need); i = -1
+        with self.zf.open(self.part) as fh:
+            for _, el in ET.iterparse(fh):
+                if el.tag != f"{{{NS_MAIN}}}si":
+                    continue
+                i += 1
+                if i in need:
+                    self.values[i] = _text(el)
+                el.clear()
+                if i >= last:
+                    break
+
+_DATE_FMT_IDS = set(range(14, 23)) | {45, 46, 47}
+_FMT_LITERAL = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.|[_*].')
+
+class CellStyles:
+    """Cell formats (styles.xml cellXfs) that display numbers as dates or times, and
+    the workbook's date epoch. The fast path converts those cells like the pandas
+    engines do instead of returning the serial number."""
+    def __init__(self, zf):
+        wb_part = _workbook_part(zf)
+        pr = ET.fromstring(zf.read(wb_part)).find(f"{{{NS_MAIN}}}workbookPr")
+        self.date1904 = pr is not None and pr.get("date1904", "").lower() in ("1", "true")
+        self.dates = set()
+        part = next((p for t,p in _rels(zf, wb_part).values() if t == "styles"), None)
+        if not part or part not in zf.NameToInfo:
+            return
+        root = ET.fromstring(zf.read(part))
+        fmts = {int(f.get("numFmtId")): f.get("formatCode", "") for f in root.iter(f"{{{NS_MAIN}}}numFmt")}
+        xfs = root.find(f"{{{NS_MAIN}}}cellXfs")
+        for i, xf in enumerate(xfs if xfs is not None else []):
+            fid = int(xf.get("numFmtId", 0))
+            code = _FMT_LITERAL.sub("", fmts.get(fid, "")).lower()
+            if fid in _DATE_FMT_IDS or re.search(r"[dmyhs]", code.split(";")[0]):
+                self.dates.add(str(i))
+
+    def value(self, x):
+        """Serial number -> Timestamp, or time of day for serials below one day."""
+        ms = round(x * 86400000)
+        if 0 <= ms < 86400000:
+            return (pd.Timestamp(0) + pd.Timedelta(milliseconds=ms)).time()
+        if not self.date1904 and 0 < x < 60:   # Excel's phantom 1900-02-29
+            ms += 86400000
+        return pd.Timestamp("1904-01-01" if self.date1904 else "1899-12-30") + pd.Timedelta(milliseconds=ms)
+
+_A1 = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|(?<![A-Za-z0-9_.$])(\$?)([A-Za-z]{1,3})(\$?)(\d+)(?![A-Za-z0-9_(!])""")
+
+def _col_label(c):
+    s = ""
+    c += 1
+    while c:
+        c, m = divmod(c-1, 26); s = chr(65+m) + s
+    return s
+
+def shift_formula(text, dr, dc):
+    """Moves the relative references of a shared formula from its master cell."""
+    def mv(m):
+        if m.group(1):   # quoted sheet name or string literal
+            return m.group(1)
+        c = _col_index(m.group(3)) + (0 if m.group(2) else dc)
+        r = int(m.group(5)) + (0 if m.group(4) else dr)
+        return f"{m.group(2)}{_col_label(c)}{m.group(4)}{r}"
+    return _A1.sub(mv, text)
+
+def iter_cells(fh, nrows=None, usecols=None, dates=()):
+    """Stream-parses a worksheet part. Yields (row, col, type, raw) for cells that
+    carry a value; stops at row nrows. Shared-string cells yield their index,
+    formula cells without a cached value yield type "f" and the formula text,
+    numbers whose style is in dates yield type "d"."""
+    C, V, ROW, IS, F = (f"{{{NS_MAIN}}}{t}" for t in ("c", "v", "row", "is", "f"))
+    r = -1; c = -1
+    shared = {}   # si -> (master formula, row, col)
+    for ev, el in ET.iterparse(fh, events=("start", "end")):
+        if ev == "start":
+            if el.tag == ROW:
+                rr = el.get("r"); r = int(rr)-1 if rr else r+1; c = -1
+                if nrows is not None and r >= nrows:
+                    return
+            continue
+        if el.tag == C:
+            ref = el.get("r"); c = _col_index(ref) if ref else c+1
+            f = el.find(F)
+            if f is not None and f.get("t") == "shared" and f.text:
+                shared[f.get("si")] = (f.text, r, c)
+            if usecols is None or c in usecols:
+                t = el.get("t", "n")
+                if t == "inlineStr":
+                    isel = el.find(IS)
+                    if isel is not None: yield r, c, "str", _text(isel)
+                else:
+                    v = el.find(V)
+                    if v is not None and v.text is not None:
+                        yield r, c, "d" if t == "n" and el.get("s") in dates else t, v.text
+                    elif f is not None:
+                        text = f.text
+                        if not text and f.get("si") in shared:
+                            m, r0, c0 = shared[f.get("si")]
+                            text = shift_formula(m, r-r0, c-c0)
+                        yield r, c, "f", text or ""
+            el.clear()
+        elif el.tag == ROW:
+            el.clear()
+
+# ---------------- Formula fallback ----------------
+class FormulaError(Exception):
+    pass
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<ref>(?:(?:'(?:[^']|'')+'|[A-Za-z0-9_.]+)!)?\$?[A-Za-z]{1,3}\$?\d+(?::\$?[A-Za-z]{1,3}\$?\d+)?)(?![A-Za-z0-9_(])
+  | (?P<func>[A-Za-z][A-Za-z0-9_.]*)\s*\(
+  | (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<str>"(?:[^"]|"")*")
+  | (?P<op>[-+*/^%(),;])
+)""", re.X)
+_MAX_RANGE = 100000
+
+def _tokenize(text):
+    pos, out, text = 0, [], text.strip().lstrip("=")
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if not m or m.end() == pos:
+            if text[pos:].strip() == "": break
+            raise FormulaError(f"unexpected {text[pos:pos+10]!r}")
+        kind = m.lastgroup; out.append((kind, m.group(kind))); pos = m.end()
+    return out
+
+def _split_ref(tok, sheet):
+    if "!" in tok:
+        sh, tok = tok.rsplit("!", 1)
+        sheet = sh[1:-1].replace("''", "'") if sh.startswith("'") else sh
+    ends = []
+    for part in tok.split(":"):
+        m = re.fullmatch(r"\$?([A-Za-z]{1,3})\$?(\d+)", part)
+        ends.append((int(m.group(2))-1, _col_index(m.group(1))))
+    return sheet, ends
+
+class _Parser:
+    """Recursive descent over Excel precedence: unary -, %, ^, * /, + -."""
+    def __init__(self, tokens, sheet):
+        self.t = tokens; self.i = 0; self.sheet = sheet
+    def peek(self):
+        return self.t[self.i] if self.i < len(self.t) else (None, None)
+    def take(self, val=None):
+        tok = self.peek()
+        if tok[0] is None or (val is not None and tok[1] != val):
+            raise FormulaError(f"expected {val}")
+        self.i += 1; return tok
+    def parse(self):
+        node = self.expr()
+        if self.i != len(self.t): raise FormulaError("trailing tokens")
+        return node
+    def expr(self):
+        node = self.term()
+        while self.peek()[1] in ("+", "-"):
+            node = ("bin", self.take()[1], node, self.term())
+        return node
+    def term(self):
+        node = self.power()
+        while self.peek()[1] in ("*", "/"):
+            node = ("bin", self.take()[1], node, self.power())
+        return node
+    def power(self):
+        node = self.unary()
+        while self.peek()[1] == "^":
+            self.take(); node = ("bin", "^", node, self.unary())
+        return node
+    def unary(self):
+        if self.peek()[1] in ("+", "-"):
+            op = self.take()[1]; node = self.unary()
+            return ("neg", node) if op == "-" else node
+        node = self.primary()
+        while self.peek()[1] == "%":
+            self.take(); node = ("bin", "/", node, ("num", 100.0))
+        return node
+    def primary(self):
+        kind, val = self.take()
+        if kind == "num": return ("num", float(val))
+        if kind == "str": return ("str", val[1:-1].replace('""', '"'))
+        if kind == "ref":
+            sheet, ends = _split_ref(val, self.sheet)
+            if len(ends) == 1: return ("ref", sheet, *ends[0])
+            (r0,c0),(r1,c1) = ends
+            return ("range", sheet, min(r0,r1), min(c0,c1), max(r0,r1), max(c0,c1))
+        if kind == "func":
+            args = []
+            if self.peek()[1] != ")":
+                args.append(self.expr())
+                while self.peek()[1] in (",", ";"):
+                    self.take(); args.append(self.expr())
+            self.take(")")
+            return ("func", val.upper(), args)
+        if val == "(":
+            node = self.expr(); self.take(")"); return node
+        raise FormulaError(f"unexpected {val!r}")
+
+def _cells_of(node):
+    if node[0] == "ref":
+        yield node[1], node[2], node[3]
+    elif node[0] == "range":
+        _, sh, r0, c0, r1, c1 = node
+        if (r1-r0+1)*(c1-c0+1) > _MAX_RANGE: raise FormulaError("range too large")
+        for r in range(r0, r1+1):
+            for c in range(c0, c1+1):
+                yield sh, r, c
+    elif node[0] in ("bin", "neg", "func"):
+        for child in (node[2] if node[0] == "func" else node[1:] if node[0] == "neg" else node[2:]):
+            yield from _cells_of(child)
+
+def _num(v):
+    if v is None: return 0.0
+    if isinstance(v, (bool, float)): return float(v)
+    try:
+        return float(v)
+    except ValueError:
+        return np.nan
+
+_FUNCS = {
+    "SUM": lambda xs: float(np.sum(xs)) if xs else 0.0,
+    "PRODUCT": lambda xs: float(np.prod(xs)) if xs else 0.0,
+    "MIN": lambda xs: float(min(xs)) if xs else 0.0,
+    "MAX": lambda xs: float(max(xs)) if xs else 0.0,
+    "AVERAGE": lambda xs: float(np.mean(xs)) if xs else np.nan,
+    "ABS": lambda xs: abs(xs[0]) if len(xs) == 1 else np.nan,
+    "ROUND": lambda xs: float(np.sign(xs[0])*np.floor(abs(xs[0])*10**int(xs[1])+0.5)/10**int(xs[1])) if len(xs) == 2 else np.nan,
+}
+
+class FormulaEvaluator:
+    """Computes formula cells that have no cached value. The cells they depend on
+    are pulled from the worksheet parts on demand (breadth-first over the
+    dependency graph, one streaming pass per sheet and level), and every
+    intermediate result is memoized, so only cells feeding the request are read."""
+    def __init__(self, wb):
+        self.wb = wb
+        self.cells = defaultdict(dict)   # sheet -> {(r,c): (type, raw)}
+        self.ast = {}; self.memo = {}; self._busy = set()
+        self.sheets = set()              # sheets read so far (they feed the results)
+
+    def evaluate(self, sheet, formulas):
+        """formulas: {(r,c): text} of `sheet` -> {(r,c): float (NaN if not computable)}"""
+        frontier = set()
+        for (r,c), text in formulas.items():
+            self.cells[sheet][(r,c)] = ("f", text); frontier.add((sheet, r, c))
+        while frontier:
+            missing = defaultdict(set)
+            for key in frontier:
+                for dep in self._deps(key):
+                    if dep[1:] not in self.cells[dep[0]]:
+                        missing[dep[0]].add(dep[1:])
+            frontier = set()
+            for sh, keys in missing.items():
+                found = self._load(sh, keys)
+                for k in keys:
+                    self.cells[sh][k] = found.get(k, ("", ""))
+                    if self.cells[sh][k][0] == "f": frontier.add((sh,)+k)
+        return {k: self._value((sheet,)+k, numeric=True) for k in formulas}
+
+    def _load(self, sheet, keys):
+        found = {}
+        self.sheets.add(sheet)
+        part = self.wb.parts.get(sheet)
+        if part and part in self.wb._zf.NameToInfo:
+            with self.wb._zf.open(part) as fh:
+                for r, c, t, raw in iter_cells(fh, max(k[0] for k in keys)+1, {k[1] for k in keys}):
+                    if (r, c) in keys: found[(r, c)] = (t, raw)
+            self.wb._sst.resolve(int(raw) for t, raw in found.values() if t == "s")
+        return found
+
+    def _deps(self, key):
+        try:
+            return list(_cells_of(self._ast(key)))
+        except FormulaError:
+            return []
+
+    def _ast(self, key):
+        if key not in self.ast:
+            try:
+                self.ast[key] = _Parser(_tokenize(self.cells[key[0]][key[1:]][1]), key[0]).parse()
+            except (FormulaError, AttributeError, ValueError) as e:
+                self.ast[key] = e
+        if isinstance(self.ast[key], Exception):
+            raise FormulaError(str(self.ast[key]))
+        return self.ast[key]
+
+    def _value(self, key, numeric=False):
+        """Cell value: None (empty), str, bool or float; formulas evaluated + memoized."""
+        if key not in self.memo:
+            t, raw = self.cells[key[0]].get(key[1:], ("", ""))
+            if t == "f":
+                if key in self._busy:
+                    return np.nan   # circular reference
+                self._busy.add(key)
+                try:
+                    v = self._eval(self._ast(key))
+                except (FormulaError, ArithmeticError, ValueError, TypeError):
+                    v = np.nan
+                finally:
+                    self._busy.discard(key)
+            elif t == "":
+                v = None
+            else:
+                v = _cell_value(t, raw, self.wb._sst)
+                v = None if v == "" else float(v) if isinstance(v, int) and not isinstance(v, bool) else v
+            self.memo[key] = v
+        v = self.memo[key]
+        return _num(v) if numeric else v
+
+    def _eval(self, node):
+        kind = node[0]
+        if kind == "num": return node[1]
+        if kind == "str": return node[1]
+        if kind == "ref": return self._value(node[1:])
+        if kind == "neg": return -_num(self._eval(node[1]))
+        if kind == "bin":
+            a, b = _num(self._eval(node[2])), _num(self._eval(node[3]))
+            op = node[1]
+            if op == "+": return a + b
+            if op == "-": return a - b
+            if op == "*": return a * b
+            if op == "/": return a / b if b else np.nan
+            return a ** b
+        if kind == "func":
+            if node[1] not in _FUNCS: raise FormulaError(f"unsupported {node[1]}")
+            xs = []
+            for arg in node[2]:
+                if arg[0] == "range":   # ranges skip text, bools and blanks like Excel
+                    xs += [v for v in (self._value(k) for k in _cells_of(arg))
+                           if isinstance(v, float) and not isinstance(v, bool)]
+                else:
+                    xs.append(_num(self._eval(arg)))
+            return _FUNCS[node[1]](xs)
+        raise FormulaError(f"cannot evaluate {kind}")
+
+def _cell_value(t, raw, sst, styles=None):
+    if t == "d" and styles is not None:
+        try:
+            return styles.value(float(raw))
+        except ValueError:
+            return ""
+    if t == "s":
+        v = sst.values.get(int(raw), "")
+    elif t in ("str", "inlineStr"):
+        v = raw
+    elif t == "b":
+        return raw.strip() in ("1", "true")
+    elif t in ("e", "f"):
+        return ""
+    else:
+        try:
+            x = float(raw)
+        except ValueError:
+            return ""
+        return int(x) if x.is_integer() else x
+    return "" if v in NA_STRINGS else v
+
+class LazyWorkbook:
+    """pd.ExcelFile stand-in: sheet names come from the zip directory, the workbook
+    itself is only loaded once a sheet actually has to be parsed. read_sheet()
+    is the fast path for a few rows/columns."""
+    def __init__(self, path, src, parts):
+        self.path = path; self.src = src; self.parts = parts
+        self.sheet_names = [n for n in parts if n is not None]
+        self._xls = None; self._zf = None; self._sst = None; self._styles = None; self._evaluator = None
+
+    def parse(self, *args, **kwargs):
+        if self._xls is None:
+            self._xls = ExcelReader(self.path)
+        return self._xls.parse(*args, **kwargs)
+
+    def _open(self):
+        if self._zf is None:
+            if hasattr(self.src, "seek"): self.src.seek(0)
+            self._zf = zipfile.ZipFile(self.src)
+            self._sst = SharedStrings(self._zf, self.parts.get(None))
+            self._styles = CellStyles(self._zf)
+        return self._zf
+
+    def formula_deps(self):
+        """{sheet: part hash} of every sheet the formula evaluator has read."""
+        if self._evaluator is None:
+            return {}
+        return {sh: part_hash(self._open(), self.parts.get(sh)) for sh in sorted(self._evaluator.sheets)}
+
+    def read_sheet(self, sheet, nrows=None, usecols=None):
+        """Values of the requested rows/cols as a header-less frame (like
+        parse(header=None, dtype=object).fillna("")). Cells outside are left empty."""
+        self._open()
+        with self._zf.open(self.parts[sheet]) as fh:
+            cells = list(iter_cells(fh, nrows, set(usecols) if usecols is not None else None, self._styles.dates))
+        self._sst.resolve(int(raw) for _,_,t,raw in cells if t == "s")
+        if not cells:
+            return pd.DataFrame()
+        formulas = {(r, c): raw for r, c, t, raw in cells if t == "f"}
+        if formulas:
+            if self._evaluator is None:
+                self._evaluator = FormulaEvaluator(self)
+            for (r, c), v in self._evaluator.evaluate(sheet, formulas).items():
+                if not np.isnan(v):
+                    cells.append((r, c, "n", repr(v)))
+        grid = np.full((max(x[0] for x in cells)+1, max(x[1] for x in cells)+1), "", dtype=object)
+        for r, c, t, raw in cells:
+            grid[r, c] = _cell_value(t, raw, self._sst, self._styles)
+        return pd.DataFrame(grid)
+
+def read_sheet(xls, sheet, nrows=None, usecols=None):
+    if isinstance(xls, LazyWorkbook):
+        try:
+            return xls.read_sheet(sheet, nrows, usecols)
+        except (KeyError, ValueError, ET.ParseError, zipfile.BadZipFile):
+            pass
+    return xls.parse(sheet, header=None, dtype=object, nrows=nrows).fillna("")
+
+def sheet_keys(path, src):
+    """Cache keys for the cost and tech results from the hashes of the worksheet
+    parts they read. Text lives in sharedStrings, so its hash is part of both keys."""
+    with zipfile.ZipFile(src) as zf:
+        parts = workbook_parts(zf)
+        wb = LazyWorkbook(path, src, parts)
+        sst = part_hash(zf, parts[None])
+        cost, tech, fb = find_cost_sheet(wb), find_sheet(wb, ["techn", "bewert"]), find_sheet(wb, ["funktionsbaum"])
+        cost_key = hashlib.sha1("\x1f".join(wb.sheet_names + [cost, part_hash(zf, parts[cost]),
+                                 part_hash(zf, parts.get(fb)), sst]).encode("utf-8")).hexdigest()
+        tech_key = hashlib.sha1("\x1f".join([tech or "", part_hash(zf, parts.get(tech)), sst]).encode("utf-8")).hexdigest()
+    return wb, cost_key, tech_key
+
+def cached_parts(xls, key, parse):
+    """cached() for results keyed by sheet_keys. Formulas without cached values may
+    read further sheets (cross-sheet references): their part hashes are stored with
+    the result, and a file whose copies of those sheets differ gets its own entry."""
+    def run():
+        value = parse()
+        return value, xls.formula_deps()
+    value, deps = cached(key, run)
+    if deps:
+        now = {sh: part_hash(xls._open(), xls.parts.get(sh)) for sh in deps}
+        if now != deps:
+            h = hashlib.sha1(repr(sorted(now.items())).encode("utf-8")).hexdigest()
+            value, _ = cached(f"{key}:{h}", run)
+    return value
+
+class MappedFile(io.RawIOBase):
+    """Read-only seekable file object over an mmap (zipfile needs seekable())."""
+    def __init__(self, mm):
+        self.mm = mm
+    def readable(self): return True
+    def seekable(self): return True
+    def tell(self): return self.mm.tell()
+    def seek(self, pos, whence=io.SEEK_SET):
+        try:
+            self.mm.seek(pos, whence)
+        except ValueError as e:   # files raise OSError here, zipfile relies on that
+            raise OSError(str(e)) from None
+        return self.mm.tell()
+    def read(self, n=-1):
+        return self.mm.read(None if n is None or n < 0 else n)
+    def readinto(self, b):
+        data = self.mm.read(len(b)); b[:len(data)] = data; return len(data)
+
+def parse_workbook(path):
+    """Parses a spooled workbook. Zip access goes through a read-only memory map,
+    so the file is paged in by the OS instead of being copied onto the heap."""
+    if os.path.getsize(path) == 0:
+        raise ValueError("Datei ist leer.")
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        try:
+            xls, cost_key, tech_key = sheet_keys(path, MappedFile(mm))
+        except (zipfile.BadZipFile, KeyError, ET.ParseError):
+            xls = ExcelReader(path)
+            layout,H1,H2 = parse_cost_structure(xls)
+            TECH = parse_tech(xls)
+        else:
+            try:
+                layout,H1,H2 = cached_parts(xls, f"cost:{cost_key}", lambda: parse_cost_structure(xls))
+                TECH = cached_parts(xls, f"tech:{tech_key}", lambda: parse_tech(xls))
+            finally:
+                if xls._zf is not None: xls._zf.close()
+    return H1, attach_tech(H2, TECH), TECH, layout
+
+def attach_tech(H2, TECH):
+    if not TECH.empty and not H2.empty:
+        return H2.merge(TECH, on="H2", how="left")
+    return H2.assign(TechScore=np.nan)
+
+def generic_columns(path):
+    """(all columns, detected cost columns) of a generic-layout workbook."""
+    xls = ExcelReader(path); probe = probe_workbook(xls)
+    cols = [str(c).strip() for c in xls.parse(probe["sheet"], nrows=0).columns]
+    return cols, _generic_plan(xls, probe)["cost_cols"]
+
+def parse_generic_override(path, cost_cols):
+    """Generic-layout workbook re-extracted with manually chosen cost columns."""
+    xls = ExcelReader(path); probe = probe_workbook(xls)
+    H1, H2 = _generic_parse(xls, probe, cost_cols)
+    TECH = parse_tech(xls)
+    return H1, attach_tech(H2, TECH), TECH, "generic"
+
+def quick_scan(path):
+    """Phase one of ingestion: sheet list, SLAVE_START metadata and the header band
+    only. The template is the first strategy whose pre-check passes."""
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        src = MappedFile(mm)
+        with zipfile.ZipFile(src) as zf:
+            wb = LazyWorkbook(path, src, workbook_parts(zf))
+        try:
+            meta = {}
+            start = next((n for n in wb.sheet_names if n.strip().lower() in START_SHEET_HINTS), None)
+            if start is not None:
+                df = read_sheet(wb, start, nrows=META_ROWS, usecols=[0, 1])
+                for i in range(df.shape[0]):
+                    k = str(df.iat[i, 0]).strip()
+                    if k and k.lower() not in ("nan", "none"):
+                        meta[k] = df.iat[i, 1] if df.shape[1] > 1 else ""
+            probe = probe_workbook(wb)
+            strat = next((x for x in STRATEGIES if x.precheck(probe)), None)
+        finally:
+            if wb._zf is not None: wb._zf.close()
+    return {"sheets": wb.sheet_names, "meta": meta, "template": strat.name if strat else "",
+            "H1": strat.scan(probe) if strat is not None and strat.scan else []}
+
+# ---------------- Upload spool ----------------
+def _sweep_spool():
+    cutoff = time.time() - SPOOL_TTL_H*3600
+    for entry in os.scandir(SPOOL_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff: os.remove(entry.path)
+        except OSError:
+            pass
+
+def _spool_path(key, name):
+    ext = os.path.splitext(name)[1].lower() or ".xlsx"
+    return os.path.join(SPOOL_DIR, key + ext)
+
+def spool_stream(fh, name):
+    """Copies a stream (e.g. a .zip member) into SPOOL_DIR in chunks while hashing it."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    h = hashlib.sha256()
+    tmp = os.path.join(SPOOL_DIR, f"in.{os.getpid()}.{threading.get_ident()}.{time.time_ns()}.part")
+    try:
+        with open(tmp, "wb") as out:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk); out.write(chunk)
+        key = h.hexdigest(); path = _spool_path(key, name)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    return key, path
+
+def spool_upload(f):
+    """Writes an upload to SPOOL_DIR once, named by its content hash, and returns
+    (hash, path). The upload buffer is hashed and written without copying it."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    with f.getbuffer() as buf:
+        key = hashlib.sha256(buf).hexdigest()
+        path = _spool_path(key, f.name)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(tmp, "wb") as out:
+                out.write(buf)
+            os.replace(tmp, path)   # atomic: readers never see a partial file
+    return key, path
+
+# ---------------- Shared parse cache ----------------
+def _nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    return 0
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event(); self.ok = False; self.value = None; self.error = None
+
+class SharedParseCache:
+    """Process-wide LRU of parse results keyed by file content hash.
+
+    Shared by all sessions. Concurrent misses for the same key are coalesced:
+    the first caller parses, the others wait for its result (single-flight).
+    Entries are evicted least-recently-used once max_bytes is exceeded.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0; self.misses = 0; self.nbytes = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()   # key -> (value, nbytes)
+        self._inflight = {}           # key -> _Flight
+
+    def get_or_parse(self, key, parse):
+        while True:
+            with self._lock:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return self._items[key][0]
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._inflight[key] = _Flight()
+                    self.misses += 1
+            if leader:
+                break
+            flight.done.wait()
+            if flight.ok:
+                return flight.value
+            if flight.error is not None:
+                raise flight.error
+            # leader was interrupted (e.g. its session reran) -> try to lead ourselves
+        try:
+            flight.value = parse()
+            flight.ok = True
+            self._put(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def _put(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes and self._items:
+                _, (_, n) = self._items.popitem(last=False)
+                self.nbytes -= n
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "MB": round(self.nbytes/2**20, 1),
+                    "hits": self.hits, "misses": self.misses}
+
+class DiskStore:
+    """SQLite-backed cache shared by all server processes on this host.
+
+    Each put is a single transaction (atomic for concurrent readers/writers).
+    Entries expire after ttl_s; beyond max_bytes the least recently accessed
+    entries are dropped. Hit/miss counters live in the database as well, so
+    they cover all processes.
+    """
+    def __init__(self, path, ttl_s, max_bytes):
+        self.path = path; self.ttl_s = ttl_s; self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                        "nbytes INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            con.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, n INTEGER NOT NULL)")
+            con.execute("INSERT OR IGNORE INTO counters VALUES ('hits',0),('misses',0),('evictions',0)")
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def _count(self, con, name, n=1):
+        con.execute("UPDATE counters SET n=n+? WHERE name=?", (n, name))
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as con:
+            row = con.execute("SELECT value, created FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_s:
+                con.execute("BEGIN IMMEDIATE")
+                if row is not None:
+                    con.execute("DELETE FROM entries WHERE key=?", (key,))
+                    self._count(con, "evictions")
+                self._count(con, "misses")
+                con.execute("COMMIT")
+                return None
+            con.execute("BEGIN IMMEDIATE")
+            con.execute("UPDATE entries SET accessed=? WHERE key=?", (now, key))
+            self._count(con, "hits")
+            con.execute("COMMIT")
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                con.execute("INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?)", (key, blob, len(blob), now, now))
+                n = con.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl_s,)).rowcount
+                # keep the most recently used entries whose cumulative size fits
+                n += con.execute("DELETE FROM entries WHERE key IN (SELECT key FROM "
+                                 "(SELECT key, SUM(nbytes) OVER (ORDER BY accessed DESC, key) AS run FROM entries) "
+                                 "WHERE run > ?)", (self.max_bytes,)).rowcount
+                if n: self._count(con, "evictions", n)
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self._connect() as con:
+            out = dict(con.execute("SELECT name, n FROM counters").fetchall())
+            n, size = con.execute("SELECT COUNT(*), COALESCE(SUM(nbytes),0) FROM entries").fetchone()
+        return {"entries": n, "MB": round(size/2**20, 1), **out}
+
+@st.cache_resource
+def parse_cache():
+    return SharedParseCache(PARSE_CACHE_MB * 2**20)
+
+@st.cache_resource
+def disk_store():
+    if not DISK_CACHE:
+        return None
+    return DiskStore(DISK_CACHE, DISK_CACHE_TTL_H * 3600, DISK_CACHE_MB * 2**20)
+
+# Fetched here, on the script thread: the parse pool threads have no ScriptRunContext,
+# so they must not call the cache_resource functions. Each rerun picks up the same objects.
+CACHES = (parse_cache(), disk_store())
+
+def cached(key, compute):
+    """Memory cache -> optional disk store -> compute. Keys are namespaced strings."""
+    key = f"v{CACHE_SCHEMA}:{key}"
+    mem, store = CACHES
+    if store is None:
+        return mem.get_or_parse(key, compute)
+    def load():
+        try:
+            value = store.get(key)
+        except sqlite3.Error:
+            value = None
+        if value is None:
+            value = compute()
+            try:
+                store.put(key, value)
+            except sqlite3.Error:
+                pass  # disk cache is best effort
+        return value
+    return mem.get_or_parse(key, load)
+
+def deviation_table(A, B):
+    sA = A.H2.set_index("H2")["H2Cost"]
+    sB = B.H2.set_index("H2")["H2Cost"]
+    idx = sorted(set(sA.index)|set(sB.index))
+    rows = []
+    for key in idx:
+        ca = float(sA.get(key, np.nan)) if key in sA else np.nan
+        cb = float(sB.get(key, np.nan)) if key in sB else np.nan
+        if np.isnan(ca) and np.isnan(cb): continue
+        delta = (0 if np.isnan(ca) else ca) - (0 if np.isnan(cb) else cb)
+        rows.append([key, ca, cb, delta, abs(delta)])
+    return pd.DataFrame(rows, columns=["H2","Cost_A","Cost_B","Delta","AbsDelta"]).sort_values("AbsDelta", ascending=False)
+
+# ---------------- Dataflow ----------------
+class Node:
+    __slots__ = ("name", "version", "value")
+    def __init__(self, name, version, value):
+        self.name=name; self.version=version; self.value=value
+
+class Dataflow:
+    """Per-session memo of derived tables and figures. A node declares its inputs -
+    products, other nodes or plain hashable values such as widget states - and is
+    only recomputed when one of them changed since the last run. A recomputed node
+    gets a new version, which marks everything downstream of it dirty.
+    The state is a plain dict kept in session_state: every rerun re-executes this
+    module, so instances of the previous run's classes must not be carried over."""
+    def __init__(self, state):
+        self._nodes = state     # name -> (input token, version, value)
+        self.recomputed = []    # node names rebuilt in this run
+
+    @classmethod
+    def _token(cls, x):
+        if isinstance(x, Node): return ("node", x.name, x.version)
+        if isinstance(x, Product): return ("product", x.key)
+        if isinstance(x, (list, tuple)): return tuple(cls._token(v) for v in x)
+        return x
+
+    @classmethod
+    def _value(cls, x):
+        if isinstance(x, Node): return x.value
+        if isinstance(x, (list, tuple)): return type(x)(cls._value(v) for v in x)
+        return x
+
+    def node(self, name, fn, *inputs):
+        token = self._token(inputs)
+        old = self._nodes.get(name)
+        if old is not None and old[0] == token:
+            return Node(name, old[1], old[2])
+        node = Node(name, old[1] + 1 if old else 0, fn(*self._value(inputs)))
+        self._nodes[name] = (token, node.version, node.value)
+        self.recomputed.append(name)
+        return node
+
+def fig_h1_costs(P):
+    H1 = P.H1
+    fig = go.Figure(go.Bar(x=H1["H1"], y=H1["H1Cost"], marker_color="#1F5AA6", width=0.35))
+    fig.update_layout(height=340, margin=dict(l=20,r=20,t=20,b=80), yaxis_title="Kosten Hauptfunktion")
+    return fig
+
+def fig_h2_costs(P):
+    # color by H1
+    h1_list = P.H1["H1"].tolist()
+    cmap_colors = ["#1F5AA6","#F28C28","#0B3C7A","#FFB347","#8A8A8A","#D46A00","#B3B3B3"]
+    cmap = {h: cmap_colors[i%len(cmap_colors)] for i,h in enumerate(h1_list)}
+    H2c = P.H2.copy()
+    H2c["Color"] = H2c["H1"].map(cmap)
+    fig = go.Figure(go.Bar(x=H2c["H2"], y=H2c["H2Cost"], marker_color=H2c["Color"], width=0.35))
+    fig.update_layout(height=420, margin=dict(l=20,r=20,t=10,b=140), yaxis_title="Kosten Nebenfunktion")
+    fig.update_xaxes(tickangle=45)
+    return fig
+
+def portfolio_axis(pairs):
+    """Union of all H2 names over (name, product) pairs."""
+    return sorted(set(h2 for _,P in pairs for h2 in P.H2["H2"].astype(str).tolist()))
+
+PALETTE = ["#1F5AA6","#F28C28","#0B3C7A","#FFB347","#8A8A8A","#D46A00","#B3B3B3","#6AA6FF","#FF8C66"]
+
+def fig_portfolio_lines(pairs, all_h2, col, yaxis_title, height, dash=None):
+    fig = go.Figure()
+    for i,(n,P) in enumerate(pairs):
+        ser = dict(P.H2[["H2",col]].dropna().values)
+        y = [ser.get(h2, np.nan) for h2 in all_h2]
+        fig.add_scatter(x=all_h2, y=y, mode="lines+markers", name=n, line=dict(color=PALETTE[i%len(PALETTE)], width=2, dash=dash))
+    fig.update_layout(height=height, margin=dict(l=20,r=20,t=10,b=160), yaxis_title=yaxis_title)
+    fig.update_xaxes(tickangle=45)
+    return fig
+
+def portfolio_key(pairs):
+    return hashlib.sha1("\x1f".join(f"{n}\x1e{P.key}" for n,P in pairs).encode("utf-8")).hexdigest()
+
+def stack_products(pairs, level, cols):
+    """The level ("H1"/"H2") tables of all products as one frame with a Produkt column,
+    or None. Concatenated once and labelled by repeat - no per-product frame ops."""
+    tables = [(n, getattr(P, level)) for n,P in pairs]
+    tables = [(n, T) for n,T in tables if not T.empty]
+    if not tables:
+        return None
+    D = pd.concat([T for _,T in tables], ignore_index=True).reindex(columns=["H1", *cols])
+    D.insert(0, "Produkt", np.repeat([n for n,_ in tables], [len(T) for _,T in tables]))
+    return D
+
+def h1_segments(pairs, cols):
+    """H2 rows (H1 + cols) of all products stacked and ordered by (product, H1 block).
+    Returns (frame, segment starts, (Produkt, H1) index per segment), or None."""
+    D = stack_products(pairs, "H2", cols)
+    if D is None:
+        return None
+    g, groups = pd.factorize(pd.MultiIndex.from_arrays([D["Produkt"], D["H1"]]), use_na_sentinel=False)
+    order = np.argsort(g, kind="stable")
+    starts = np.flatnonzero(np.r_[True, g[order][1:] != g[order][:-1]])
+    return D.iloc[order].reset_index(drop=True), starts, groups.take(g[order][starts])
+
+def _tech_h1(x, w, starts):
+    """(mean, weighted, normalized) H1 scores as segment sums along the last axis;
+    x may carry leading draw dimensions (Monte Carlo)."""
+    hx, hw = ~np.isnan(x), ~np.isnan(w)
+    x0, w0 = np.where(hx, x, 0.0), np.where(hw, w, 0.0)
+    seg = lambda a: np.add.reduceat(a, starts, axis=-1)
+    n_x, n_w, sum_w = seg(hx.astype(float)), seg(hw.astype(float)), seg(w0)
+    both = hx & hw
+    sum_bw = seg(np.where(both, w, 0.0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(n_x > 0, seg(x0) / n_x, np.nan)
+        weighted = np.where((n_w > 0) & (sum_w > 0), seg(x0 * w0), mean)
+        norm = np.where(sum_bw > 0, seg(np.where(both, x * w, 0.0)) / sum_bw, np.nan)
+    return mean, weighted, norm
+
+def tech_scores(pairs):
+    """H1 tech scores of all products at once. The H2 rows of every product form one
+    array ordered by (product, H1 block); each statistic is a segment sum over it.
+      TechMean      mean of the H2 scores
+      TechWeighted  sum(score x H2 weight), missing as 0 (v10.3); the mean if the H1 has no weights
+      TechNorm      sum(score x weight) / sum(weight) over H2 with both (v09)"""
+    cols = ["Produkt","H1","TechMean","TechWeighted","TechNorm"]
+    seg = h1_segments(pairs, ["H2Weight","TechScore"])
+    if seg is None:
+        return pd.DataFrame(columns=cols)
+    D, starts, key = seg
+    mean, weighted, norm = _tech_h1(D["TechScore"].to_numpy(dtype=float), D["H2Weight"].to_numpy(dtype=float), starts)
+    return pd.DataFrame({"Produkt": key.get_level_values(0), "H1": key.get_level_values(1),
+                         "TechMean": mean, "TechWeighted": weighted, "TechNorm": norm}, columns=cols)
+
+def fig_tech_h1(scores, metric):
+    fig = go.Figure()
+    for i,(n,S) in enumerate(scores.groupby("Produkt", sort=False)):
+        fig.add_bar(x=S["H1"], y=S[metric], name=n, marker_color=PALETTE[i%len(PALETTE)])
+    fig.update_layout(height=360, barmode="group", margin=dict(l=20,r=20,t=10,b=80), yaxis_title="TechScore H1")
+    return fig
+
+def fig_top_deviation(dd, n=10):
+    top = dd.head(n)
+    fig = go.Figure(go.Bar(x=top["H2"], y=top["AbsDelta"], marker_color="#1F5AA6", width=0.35))
+    fig.update_layout(height=380, margin=dict(l=20,r=20,t=10,b=160), yaxis_title="|Delta|")
+    fig.update_xaxes(tickangle=45)
+    return fig
+
+# ---------------- What-if ----------------
+# delta = {"H1": {h1: {"H1Weight": v}}, "H2": {(h1, h2): {"H2Weight": v, "H2Cost": v}}}
+def delta_key(delta):
+    return hashlib.sha1(repr(sorted((lvl, repr(k), sorted(ch.items())) for lvl, d in delta.items()
+                                    for k, ch in d.items())).encode("utf-8")).hexdigest()[:16]
+
+def _override(D, index, changes, field):
+    """Writes the overrides for one field into D (a copy); returns (row positions, old values).
+    index labels need not be unique - an H1 label may open several blocks, every row
+    with an overridden label is rewritten."""
+    vals = {k: ch[field] for k, ch in changes.items() if field in ch}
+    pos = np.flatnonzero(index.isin(list(vals))) if vals else np.array([], dtype=int)
+    if not len(pos):
+        return pos, np.array([])
+    col = D.columns.get_loc(field)
+    old = D[field].to_numpy(dtype=float)[pos]
+    D.iloc[pos, col] = np.array([vals[k] for k in index[pos]], dtype=float)
+    return pos, old
+
+def _h1_rows(H1, H2):
+    """Position of each H2 row's H1 row (-1: none). Fixed-layout tables carry the plan's
+    Block id, since a label may open several blocks; the other layouts have unique H1 labels."""
+    if "Block" in H1 and "Block" in H2:
+        return pd.Index(H1["Block"]).get_indexer(H2["Block"])
+    first = pd.Series(np.arange(len(H1)), index=H1["H1"].to_numpy()).groupby(level=0).first()
+    return first.reindex(H2["H1"].to_numpy()).fillna(-1).to_numpy(dtype=int)
+
+def apply_delta(P, delta):
+    """P with the delta applied. Only the H2 rows named in the delta are rewritten;
+    an H2 cost change is added to its own H1 cost row, all other rows are shared."""
+    H1, H2 = P.H1, P.H2
+    if delta.get("H2"):
+        H2 = H2.copy()
+        _override(H2, pd.MultiIndex.from_frame(H2[["H1","H2"]]), delta["H2"], "H2Weight")
+        pos, old = _override(H2, pd.MultiIndex.from_frame(H2[["H1","H2"]]), delta["H2"], "H2Cost")
+        if len(pos):
+            diff = H2["H2Cost"].to_numpy(dtype=float)[pos] - np.nan_to_num(old)
+            rows = _h1_rows(H1, H2)[pos]
+            ok = rows >= 0
+            H1 = H1.copy()
+            cost = H1["H1Cost"].to_numpy(dtype=float).copy()
+            cost[rows[ok]] = np.nan_to_num(cost[rows[ok]])
+            np.add.at(cost, rows[ok], diff[ok])
+            H1["H1Cost"] = cost
+    if delta.get("H1"):
+        H1 = H1.copy() if H1 is P.H1 else H1
+        _override(H1, pd.Index(H1["H1"]), delta["H1"], "H1Weight")
+    return Product(P.name, H1, H2, P.TECH, key=f"{P.key}:wi:{delta_key(delta)}", layout=P.layout, path=P.path)
+
+def portfolio_scores(base_pairs, pairs):
+    """H1 tech scores with what-if products: the cached base scores, with only the
+    rows of changed products recomputed."""
+    base = cached(f"techscores:{portfolio_key(base_pairs)}", lambda: tech_scores(base_pairs))
+    changed = [(n,P) for (n,P),(_,B) in zip(pairs, base_pairs) if P is not B]
+    if not changed:
+        return base
+    out = pd.concat([base[~base["Produkt"].isin([n for n,_ in changed])], tech_scores(changed)], ignore_index=True)
+    rank = {n: i for i,(n,_) in enumerate(pairs)}
+    return out.iloc[np.argsort(out["Produkt"].map(rank).to_numpy(), kind="stable")].reset_index(drop=True)
+
+WHATIF_COLS = {"Gewicht %": "Weight", "Kosten": "Cost"}
+
+def store_whatif_edits(name, level, editor_key, table):
+    """on_change of the what-if editors: edited cells -> sparse delta in session_state."""
+    d = st.session_state["whatif"].setdefault(name, {}).setdefault(level, {})
+    for i, changes in st.session_state[editor_key]["edited_rows"].items():
+        row = table.iloc[int(i)]
+        k = (row["H1"], row["H2"]) if level == "H2" else row["H1"]
+        for col, v in changes.items():
+            field = level + WHATIF_COLS[col]
+            if v is None:
+                d.get(k, {}).pop(field, None)
+            else:
+                d.setdefault(k, {})[field] = v / 100.0 if col == "Gewicht %" else float(v)
+        if k in d and not d[k]: del d[k]
+
+class ScenarioStore:
+    """Named scenarios as sparse deltas over the parsed base portfolio: name ->
+    {product: delta}. The state is a plain dict in session_state; nothing is
+    copied until a scenario is materialized, and then only the products it touches."""
+    def __init__(self, state):
+        self.state = state
+
+    def names(self):
+        return list(self.state)
+
+    def save(self, name, deltas):
+        self.state[name] = {n: copy.deepcopy(d) for n, d in deltas.items() if any(d.values())}
+
+    def deltas(self, name):
+        return copy.deepcopy(self.state[name])
+
+    def delete(self, name):
+        self.state.pop(name, None)
+
+    def token(self, name):
+        return tuple(sorted((n, delta_key(d)) for n, d in self.state[name].items()))
+
+    def materialize(self, name, base):
+        """(name, product) pairs of the scenario; untouched products are the base objects."""
+        d = self.state[name]
+        return tuple((n, apply_delta(P, d[n]) if n in d else P) for n, P in base.items())
+
+def scenario_summary(pairs):
+    """Total cost and mean weighted H1 tech score per product."""
+    S = tech_scores(pairs).groupby("Produkt", sort=False)["TechWeighted"].mean()
+    return pd.DataFrame({"Produkt": [n for n,_ in pairs],
+                         "Kosten": [P.H1["H1Cost"].sum(min_count=1) for _,P in pairs],
+                         "Tech": [S.get(n, np.nan) for n,_ in pairs]})
+
+def compare_scenarios(store, names, base):
+    """Long table Szenario/Produkt/Kosten/Tech; products a scenario does not touch
+    reuse the base summary rows."""
+    base_pairs = tuple(base.items())
+    rows = [cached(f"scenario:base:{portfolio_key(base_pairs)}", lambda: scenario_summary(base_pairs)).assign(Szenario="Basis")]
+    for name in names:
+        touched = [(n, P) for n, P in store.materialize(name, base) if P is not base[n]]
+        if not touched:
+            rows.append(rows[0].assign(Szenario=name)); continue
+        own = scenario_summary(tuple(touched)).set_index("Produkt")
+        out = rows[0].set_index("Produkt").copy()
+        out.loc[own.index, ["Kosten","Tech"]] = own[["Kosten","Tech"]]
+        rows.append(out.reset_index().assign(Szenario=name))
+    return pd.concat(rows, ignore_index=True)[["Szenario","Produkt","Kosten","Tech"]]
+
+def fig_scenarios(table):
+    fig = go.Figure()
+    for i,(n,S) in enumerate(table.groupby("Szenario", sort=False)):
+        fig.add_bar(x=S["Produkt"], y=S["Kosten"], name=n, marker_color=PALETTE[i%len(PALETTE)])
+    fig.update_layout(height=360, barmode="group", margin=dict(l=20,r=20,t=10,b=80), yaxis_title="Gesamtkosten")
+    return fig
+
+# ---------------- Simulation ----------------
+MC_BATCH = 500   # draws per vectorized block; bounds the (draws x H2 rows) temporaries
+
+def _mc_factors(rng, dist, shape):
+    """Relative deviations in [-1, 1]: uniform or triangular (mode 0)."""
+    return rng.triangular(-1.0, 0.0, 1.0, shape) if dist == "triangular" else rng.uniform(-1.0, 1.0, shape)
+
+def _segment_mean(a, starts):
+    """nan-skipping mean of each segment along the last axis."""
+    has = ~np.isnan(a)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (np.add.reduceat(np.where(has, a, 0.0), starts, axis=-1)
+                / np.add.reduceat(has.astype(float), starts, axis=-1))
+
+def _cost_at(C, idx):
+    """Costs at row positions idx (-1 = H2 missing in that product -> 0)."""
+    return np.where(idx >= 0, np.nan_to_num(C[..., np.maximum(idx, 0)]), 0.0)
+
+def _percentiles(X, q=(10, 50, 90)):
+    """Percentiles over the draw axis; columns without any value stay NaN."""
+    Q = np.full((len(q), X.shape[1]), np.nan)
+    ok = ~np.isnan(X).all(axis=0)
+    if ok.any(): Q[:, ok] = np.percentile(X[:, ok], q, axis=0)
+    return Q
+
+def monte_carlo(pairs, n_draws, cost_spread, score_spread, dist, seed, pair=None):
+    """Monte Carlo over all products at once: every H2 cost and tech score is drawn
+    as base x (1 + spread x factor). Per draw the H1 costs (file value + sum of the
+    H2 changes), the overall scores (mean weighted H1 score, as in the scenarios) and,
+    for the product pair A/B, the ranks of the H2 cost deviations are computed as
+    segment sums over the stacked H2 rows. Returns P10/P50/P90 tables; the same seed
+    gives the same numbers."""
+    seg = h1_segments(pairs, ["H2","H2Weight","H2Cost","TechScore"])
+    if seg is None:
+        return None
+    D, starts, key = seg
+    c, x, w = (D[col].to_numpy(dtype=float) for col in ("H2Cost","TechScore","H2Weight"))
+    prod = key.get_level_values(0)
+    p_starts = np.flatnonzero(np.r_[True, prod[1:] != prod[:-1]])
+    H1 = stack_products(pairs, "H1", ["H1Cost"])
+    H1 = H1 if H1 is not None else pd.DataFrame(columns=["Produkt","H1","H1Cost"])
+    # a label may open several blocks: its file cost is the sum over them
+    base_h1 = (H1.groupby(["Produkt","H1"], sort=False)["H1Cost"].sum(min_count=1)
+               .reindex(key).to_numpy(dtype=float))
+    base_h1 = np.where(np.isnan(base_h1), np.add.reduceat(np.nan_to_num(c), starts), base_h1)
+
+    dev = None
+    if pair and pair[0] != pair[1] and set(pair) <= set(prod):
+        first = [pd.Series(D.index[m], index=D["H2"][m]).groupby(level=0).first()
+                 for m in (D["Produkt"].eq(n).to_numpy() for n in pair)]
+        h2 = first[0].index.union(first[1].index)
+        ia, ib = (f.reindex(h2).fillna(-1).to_numpy(dtype=int) for f in first)
+        dev = (h2, ia, ib)
+
+    out_h1, out_score, out_rank = [], [], []
+    rng = np.random.default_rng(seed)
+    for lo in range(0, n_draws, MC_BATCH):
+        m = min(MC_BATCH, n_draws - lo)
+        cd = c * (1.0 + cost_spread * _mc_factors(rng, dist, (m, len(c))))
+        xd = x * (1.0 + score_spread * _mc_factors(rng, dist, (m, len(x))))
+        out_h1.append(base_h1 + np.add.reduceat(np.nan_to_num(cd - c), starts, axis=1))
+        out_score.append(_segment_mean(_tech_h1(xd, w, starts)[1], p_starts))
+        if dev is not None:
+            absd = np.abs(_cost_at(cd, dev[1]) - _cost_at(cd, dev[2]))
+            ranks = np.empty(absd.shape, dtype=np.int32)
+            np.put_along_axis(ranks, np.argsort(-absd, axis=1, kind="stable"), np.arange(1, absd.shape[1] + 1), axis=1)
+            out_rank.append(ranks)
+
+    Q = _percentiles(np.vstack(out_h1))
+    h1 = pd.DataFrame({"Produkt": prod, "H1": key.get_level_values(1), "Basis": base_h1, "P10": Q[0], "P50": Q[1], "P90": Q[2]})
+    Q = _percentiles(np.vstack(out_score))
+    score = pd.DataFrame({"Produkt": prod[p_starts], "Basis": _segment_mean(_tech_h1(x, w, starts)[1], p_starts),
+                          "P10": Q[0], "P50": Q[1], "P90": Q[2]})
+    rank = None
+    if dev is not None:
+        h2, ia, ib = dev
+        R = np.vstack(out_rank)
+        Q = np.percentile(R, (10, 50, 90), axis=0)
+        rank = (pd.DataFrame({"H2": h2, "AbsDelta": np.abs(_cost_at(c, ia) - _cost_at(c, ib)),
+                              "P10": Q[0], "P50": Q[1], "P90": Q[2], "Top 10 %": (R <= 10).mean(axis=0) * 100})
+                .sort_values("AbsDelta", ascending=False, kind="stable").head(10).reset_index(drop=True))
+    return {"h1": h1, "score": score, "rank": rank}
+
+def fig_mc_h1(table):
+    fig = go.Figure(go.Bar(x=table["H1"], y=table["P50"], marker_color="#1F5AA6", name="P50",
+                           error_y=dict(type="data", symmetric=False, array=table["P90"] - table["P50"],
+                                        arrayminus=table["P50"] - table["P10"])))
+    fig.add_scatter(x=table["H1"], y=table["Basis"], mode="markers", name="Datei", marker=dict(color="#FFD24D", size=10, line=dict(color="#333", width=1)))
+    fig.update_layout(height=360, margin=dict(l=20,r=20,t=10,b=80), yaxis_title="Kosten H1 (P10–P90)")
+    return fig
+
+# ---------------- Target costing ----------------
+TARGET_COLS = ["Produkt","Ebene","H1","H2","Kosten","Kostenanteil","Gewichtsanteil","Wertindex"]
+
+def _product_starts(prod):
+    prod = np.asarray(prod)
+    return np.flatnonzero(np.r_[True, prod[1:] != prod[:-1]])
+
+def _shares(v, starts):
+    """v in % of its product's total (missing values count as 0; no total -> NaN)."""
+    tot = np.add.reduceat(np.nan_to_num(v), starts)
+    tot = np.repeat(np.where(tot > 0, tot, np.nan), np.diff(np.r_[starts, len(v)]))
+    return v / tot * 100.0
+
+def target_costing(pairs):
+    """Cost share vs weight (importance) share and value index = weight share / cost
+    share of every H1 and H2 of all products, each product's rows one segment of the
+    stacked tables. An H2's weight is its H1 weight x its weight within the H1."""
+    out = []
+    D = stack_products(pairs, "H1", ["H1Weight","H1Cost"])
+    if D is not None:
+        starts = _product_starts(D["Produkt"])
+        out.append(pd.DataFrame({"Produkt": D["Produkt"], "Ebene": "H1", "H1": D["H1"], "H2": "",
+                                 "Kosten": D["H1Cost"].to_numpy(dtype=float),
+                                 "Kostenanteil": _shares(D["H1Cost"].to_numpy(dtype=float), starts),
+                                 "Gewichtsanteil": _shares(D["H1Weight"].to_numpy(dtype=float), starts)}))
+        seg = h1_segments(pairs, ["H2","H2Weight","H2Cost"])
+        if seg is not None:
+            D2, _, _ = seg
+            w1 = (D.drop_duplicates(["Produkt","H1"]).set_index(["Produkt","H1"])["H1Weight"]
+                  .reindex(pd.MultiIndex.from_frame(D2[["Produkt","H1"]])).to_numpy(dtype=float))
+            starts = _product_starts(D2["Produkt"])
+            c = D2["H2Cost"].to_numpy(dtype=float)
+            out.append(pd.DataFrame({"Produkt": D2["Produkt"], "Ebene": "H2", "H1": D2["H1"], "H2": D2["H2"], "Kosten": c,
+                                     "Kostenanteil": _shares(c, starts),
+                                     "Gewichtsanteil": _shares(w1 * D2["H2Weight"].to_numpy(dtype=float), starts)}))
+    if not out:
+        return pd.DataFrame(columns=TARGET_COLS)
+    T = pd.concat(out, ignore_index=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        T["Wertindex"] = np.where(T["Kostenanteil"] > 0, T["Gewichtsanteil"] / T["Kostenanteil"], np.nan)
+    return T[TARGET_COLS]
+
+def target_zone(T, q):
+    """Zielkostenzone (Tanaka): cost share y within sqrt(x^2 - q^2) .. sqrt(x^2 + q^2)
+    of the weight share x, all in %."""
+    x, y = T["Gewichtsanteil"].to_numpy(dtype=float), T["Kostenanteil"].to_numpy(dtype=float)
+    upper, lower = np.sqrt(x**2 + q**2), np.sqrt(np.clip(x**2 - q**2, 0, None))
+    return pd.Series(np.select([np.isnan(x) | np.isnan(y), y > upper, y < lower], ["–", "zu teuer", "zu günstig"], "in Zone"),
+                     index=T.index)
+
+def fig_target_chart(T, q):
+    fig = go.Figure()
+    zone = target_zone(T, q)
+    for i,(n,S) in enumerate(T.groupby("Produkt", sort=False)):
+        fig.add_scatter(x=S["Gewichtsanteil"], y=S["Kostenanteil"], mode="markers", name=n,
+                        text=np.where(S["H2"].eq(""), S["H1"], S["H2"]),
+                        marker=dict(color=PALETTE[i%len(PALETTE)], size=9,
+                                    symbol=np.where(zone[S.index].eq("in Zone"), "circle", "diamond-open")))
+    top = float(np.nanmax(T[["Gewichtsanteil","Kostenanteil"]].to_numpy(dtype=float), initial=0)) * 1.1 + q
+    x = np.linspace(0, top, 200)
+    fig.add_scatter(x=x, y=np.sqrt(x**2 + q**2), mode="lines", name="Zone oben", line=dict(color="#999", dash="dot"))
+    fig.add_scatter(x=x, y=np.sqrt(np.clip(x**2 - q**2, 0, None)), mode="lines", name="Zone unten", line=dict(color="#999", dash="dot"))
+    fig.add_scatter(x=[0, top], y=[0, top], mode="lines", name="Wertindex 1", line=dict(color="#CCAA00"))
+    fig.update_layout(height=520, margin=dict(l=20,r=20,t=10,b=40), xaxis_title="Gewichtsanteil %", yaxis_title="Kostenanteil %",
+                      xaxis_range=[0, top], yaxis_range=[0, top])
+    return fig
+
+# ---------------- Benchmark ----------------
+def benchmark_index(pairs):
+    """Sorted arrays for the best-in-class query. The H2 rows with cost and tech score
+    are ordered by (H2, tech score descending) with the running cost minimum alongside,
+    so the rows meeting a threshold are a prefix of their H2 block and its cheapest
+    cost is the running minimum at the block's searchsorted position."""
+    D = stack_products(pairs, "H2", ["H2","H2Cost","TechScore"])
+    if D is None:
+        return None
+    D = D[D["H2"].notna()].reset_index(drop=True)
+    g, h2 = pd.factorize(D["H2"])
+    c, x = D["H2Cost"].to_numpy(dtype=float), D["TechScore"].to_numpy(dtype=float)
+    ok = ~np.isnan(c) & ~np.isnan(x)
+    lo, span = (np.nanmin(x[ok]), np.ptp(x[ok]) + 1.0) if ok.any() else (0.0, 1.0)
+    k = g[ok] + (lo + span - x[ok]) / (span + 1.0)   # in [g, g + 1), tech descending within g
+    order = np.argsort(k, kind="stable")
+    k, cs, gs = k[order], c[ok][order], g[ok][order]
+    cummin = pd.Series(cs).groupby(gs).cummin().to_numpy()
+    median = pd.Series(c).groupby(g).median().reindex(range(len(h2))).to_numpy()
+    return {"rows": D[["Produkt","H2","H2Cost","TechScore"]].assign(g=g), "H2": h2, "key": k, "cummin": cummin,
+            "start": np.searchsorted(k, np.arange(len(h2))), "median": median, "lo": lo, "span": span,
+            "tech_range": (float(np.nanmin(x[ok])), float(np.nanmax(x[ok]))) if ok.any() else (0.0, 0.0)}
+
+def benchmark(index, threshold):
+    """(per-H2 table, per-product gaps) for TechScore >= threshold: one searchsorted per
+    H2 block on the cached arrays, no rescan of the rows."""
+    G = len(index["H2"])
+    q = np.arange(G) + (index["lo"] + index["span"] - threshold) / (index["span"] + 1.0)
+    end = np.searchsorted(index["key"], np.clip(q, np.arange(G), np.arange(G) + 1 - 1e-12), side="right")
+    has = end > index["start"]
+    best = np.full(G, np.nan)
+    best[has] = index["cummin"][end[has] - 1]   # no row with cost and score -> no best anywhere
+    R = index["rows"]
+    gap = R["H2Cost"].to_numpy(dtype=float) - best[R["g"].to_numpy()]
+    rows = R.drop(columns="g").assign(BestInClass=best[R["g"].to_numpy()], Gap=gap, Einsparung=np.clip(gap, 0, None))
+    per_h2 = pd.DataFrame({"H2": index["H2"], "BestInClass": best, "Median": index["median"],
+                           "Qualifiziert": end - index["start"]})
+    per_h2["Einsparpotenzial"] = rows.groupby(R["g"].to_numpy())["Einsparung"].sum(min_count=1).reindex(range(G)).to_numpy()
+    return per_h2.sort_values("Einsparpotenzial", ascending=False, kind="stable").reset_index(drop=True), rows
+
+# ---------------- Pareto ----------------
+def pareto_dominated(cost, score, groups=None):
+    """True where another point of the same group has cost <= and score >= with one of
+    them strict (low cost and high score are better); NaN points are not flagged.
+    One lexsort (group, cost, -score) plus a running maximum of the score: a point is
+    dominated iff an earlier one in its group already reached its score - O(n log n)."""
+    cost, score = np.asarray(cost, dtype=float), np.asarray(score, dtype=float)
+    g = np.zeros(len(cost), dtype=int) if groups is None else pd.factorize(np.asarray(groups))[0]
+    ok = ~np.isnan(cost) & ~np.isnan(score)
+    out = np.zeros(len(cost), dtype=bool)
+    if not ok.any():
+        return out
+    idx = np.flatnonzero(ok)[np.lexsort((-score[ok], cost[ok], g[ok]))]
+    gs, cs, ss = g[idx], cost[idx], score[idx]
+    same_g = np.r_[False, gs[1:] == gs[:-1]]
+    dup = same_g & np.r_[False, (cs[1:] == cs[:-1]) & (ss[1:] == ss[:-1])]
+    best = pd.Series(ss).groupby(gs).cummax().to_numpy()
+    prev = np.where(same_g, np.r_[-np.inf, best[:-1]], -np.inf)
+    run = np.cumsum(~dup) - 1                      # identical points share the verdict of the first
+    first = np.flatnonzero(~dup)
+    out[idx] = (prev[first] >= ss[first])[run]
+    return out
+
+def pareto_points(pairs, scores):
+    """Cost vs weighted tech score per product (total H1 cost, mean weighted H1 score)
+    and per (product, H1); the H1 points are compared within the same H1 only."""
+    H1 = stack_products(pairs, "H1", ["H1Cost"])
+    if H1 is None:
+        return None, None
+    h1 = H1.merge(scores[["Produkt","H1","TechWeighted"]], on=["Produkt","H1"], how="left")
+    h1["Dominiert"] = pareto_dominated(h1["H1Cost"], h1["TechWeighted"], h1["H1"])
+    prod = (h1.groupby("Produkt", sort=False)
+            .agg(Kosten=("H1Cost", lambda v: v.sum(min_count=1)), TechWeighted=("TechWeighted", "mean")).reset_index())
+    prod["Dominiert"] = pareto_dominated(prod["Kosten"], prod["TechWeighted"])
+    return prod, h1
+
+def pareto_view(points, h1=None):
+    """(points, cost column) of one view of pareto_points: the products, or the
+    (product, H1) points of one H1."""
+    prod, h1_pts = points
+    if h1 is None:
+        return prod, "Kosten"
+    return h1_pts[h1_pts["H1"].eq(h1)], "H1Cost"
+
+def fig_pareto(points, cost, label):
+    pts = points.dropna(subset=[cost, "TechWeighted"])
+    front = pts[~pts["Dominiert"]].sort_values(cost)
+    fig = go.Figure()
+    fig.add_scatter(x=pts.loc[pts["Dominiert"], cost], y=pts.loc[pts["Dominiert"], "TechWeighted"], mode="markers",
+                    name="dominiert", text=pts.loc[pts["Dominiert"], label], marker=dict(color="#BBBBBB", size=8))
+    fig.add_scatter(x=front[cost], y=front["TechWeighted"], mode="lines+markers", name="Pareto-Front", text=front[label],
+                    line=dict(color="#1F5AA6", shape="hv"), marker=dict(color="#FFD24D", size=11, line=dict(color="#333", width=1)))
+    fig.update_layout(height=420, margin=dict(l=20,r=20,t=10,b=40), xaxis_title="Kosten", yaxis_title="TechScore gewichtet")
+    return fig
+
+# ---------------- Ingestion ----------------
+@st.cache_resource
+def parse_pool():
+    return ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="fka-parse")
+
+def load_product(key, path):
+    return cached(f"product:{key}", lambda: parse_workbook(path))
+
+def _is_workbook_member(info):
+    base = posixpath.basename(info.filename)
+    return (not info.is_dir() and base.lower().endswith((".xlsx", ".xlsm"))
+            and not base.startswith("~$") and not info.filename.startswith("__MACOSX/"))
+
+def iter_uploads(files, errors):
+    """Yields (name, label, key, path) per workbook. Members of .zip uploads are
+    streamed into the spool one at a time - the archive is never unpacked as a whole."""
+    for f in files:
+        if not f.name.lower().endswith(".zip"):
+            key, path = spool_upload(f)
+            yield f.name, f.name, key, path
+            continue
+        try:
+            zf = zipfile.ZipFile(f)
+        except zipfile.BadZipFile as e:
+            errors.append(f"{f.name}: {e}"); continue
+        with zf:
+            for info in filter(_is_workbook_member, zf.infolist()):
+                label = f"{f.name}/{info.filename}"
+                if info.file_size > MAX_MEMBER_MB * 2**20:
+                    errors.append(f"{label}: größer als {MAX_MEMBER_MB} MB – übersprungen"); continue
+                try:
+                    with zf.open(info) as fh:
+                        key, path = spool_stream(fh, info.filename)
+                except (zipfile.BadZipFile, RuntimeError, OSError) as e:   # RuntimeError: encrypted
+                    errors.append(f"{label}: {e}"); continue
+                yield posixpath.basename(info.filename), label, key, path
+
+def spool_uploads(files, on_spooled=None):
+    """Spools every upload once per session; reruns reuse the entries as long as
+    the spooled files are still there. on_spooled(item, n) is called for each newly
+    spooled workbook (n: workbooks so far), so its parse can start while the next
+    member is extracted. Returns ([(name, label, key, path)], errors)."""
+    memo = st.session_state.setdefault("spooled", {})
+    items, errors = [], []
+    note = st.empty()
+    for f in files:
+        fid = getattr(f, "file_id", None) or f.name
+        if fid not in memo or not all(os.path.exists(x[3]) for x in memo[fid][0]):
+            got, errs = [], []
+            for item in iter_uploads([f], errs):
+                note.caption(f"Entpackt: {item[1]}"); got.append(item)
+                if on_spooled is not None: on_spooled(item, len(items) + len(got))
+            memo[fid] = (got, errs)
+        items += memo[fid][0]; errors += memo[fid][1]
+    note.empty()
+    return items, errors
+
+def _unique_names(items):
+    names, out = set(), []
+    for name, label, _, _ in items:
+        if name in names: name = label
+        n = 2
+        while name in names: name, n = f"{label} ({n})", n + 1
+        names.add(name); out.append(name)
+    return out
+
+class IngestJob:
+    """Background parses of one session: a future per content hash plus timings for
+    the progress line. cancel() drops everything still queued; parses already
+    running finish (their results land in the cache) but are no longer waited for."""
+    def __init__(self, pool):
+        self.pool = pool; self.cancelled = False
+        self.futures = {}; self.labels = {}; self.started = {}; self.took = {}
+
+    def submit(self, key, path, label):
+        fut = self.futures.get(key)
+        if fut is None or fut.cancelled():
+            self.labels[key] = label
+            self.futures[key] = fut = self.pool.submit(self._run, key, path)
+        return fut
+
+    def _run(self, key, path):
+        t = self.started[key] = time.time()
+        try:
+            return load_product(key, path)
+        finally:
+            self.took[key] = time.time() - t
+
+    def cancel(self, keys=None):
+        """Drops the queued parses of keys; without keys the whole batch is cancelled."""
+        if keys is None: self.cancelled = True
+        for k in self.futures if keys is None else keys:
+            self.futures[k].cancel()
+
+    def progress(self, keys):
+        """(done, total, running labels, ETA in s or None) over the given keys."""
+        keys = [k for k in dict.fromkeys(keys) if k in self.futures]
+        done = sum(self.futures[k].done() for k in keys)
+        running = [self.labels[k] for k in keys if k in self.started and not self.futures[k].done()]
+        took = [self.took[k] for k in keys if k in self.took]
+        eta = sum(took) / len(took) * -(-(len(keys) - done) // PARSE_WORKERS) if took and done < len(keys) else None
+        return done, len(keys), running, eta
+
+def ingest_job():
+    """The session's IngestJob. It lives in the session, so reruns pick up finished
+    results instead of starting over."""
+    job = st.session_state.get("ingest_job")
+    if job is None:
+        job = st.session_state["ingest_job"] = IngestJob(parse_pool())
+    return job
+
+def ingest(items, lazy):
+    """Two-phase ingestion. Phase one quick-scans every workbook (cheap, cached).
+    Phase two parses on the session's IngestJob: all files right away (unless the
+    batch was cancelled), or - lazy - only when a product's data is first touched.
+    Parses already started while spooling are picked up, not repeated. Returns
+    (products, overview table, keys still parsing, errors); without lazy, products
+    only holds the files finished so far."""
+    job = ingest_job()
+    products, rows, pending, errors = {}, [], [], []
+    for name, (_, label, key, path) in zip(_unique_names(items), items):
+        try:
+            scan = cached(f"scan:{key}", lambda: quick_scan(path))
+        except Exception:
+            scan = {"sheets": [], "meta": {}, "template": "", "H1": []}   # the full parse reports it
+        fut = job.futures.get(key) if lazy or job.cancelled else job.submit(key, path, label)
+        P = Product(name, key=key, submit=lambda k=key, p=path, l=label: job.submit(k, p, l), future=fut, path=path)
+        layout, h1 = scan["template"], scan["H1"]
+        if not P.loaded:
+            if fut is None or fut.cancelled():
+                status = "bei Bedarf" if lazy else "abgebrochen"
+            else:
+                status = "läuft" if key in job.started else "wartet"; pending.append(key)
+            if lazy: products[name] = P
+        elif P.wait().error:   # finished, so waiting does not block
+            status = "Fehler"; errors.append(f"{label}: {P.error}")
+        else:
+            products[name] = P
+            status, layout, h1 = "fertig", P.layout, P.H1["H1"].astype(str).tolist()
+        rows.append([name, status, layout or "?", ", ".join(h1), len(scan["sheets"]),
+                     "; ".join(f"{k}: {v}" for k, v in scan["meta"].items())])
+    overview = pd.DataFrame(rows, columns=["Produkt","Status","Vorlage","Hauptfunktionen (H1)","Blätter","Metadaten"])
+    return products, overview, list(dict.fromkeys(pending)), errors   # identical uploads share one parse
+
+def load_all(products):
+    """Starts every outstanding parse at once, then waits for them with a progress bar."""
+    todo = [P.start() for P in products if not P.loaded]
+    if not todo:
+        return
+    bar = st.progress(0.0)
+    for i, P in enumerate(todo, 1):
+        P.wait()
+        bar.progress(i / len(todo), text=f"Geparst {i}/{len(todo)}: {P.name}")
+    bar.empty()
 
 # ---------------- UI ----------------
 st.markdown("# EFESO – Functional Cost Analysis TOOLSET")
 st.caption(f"Version {VERSION} • Vorlage für Funktions- & Kostenanalyse")
 
-files = st.file_uploader("Excel-Dateien (.xlsx/.xlsm) — je Produkt eine Datei",
-                         type=["xlsx","xlsm"], accept_multiple_files=True)
+files = st.file_uploader("Excel-Dateien (.xlsx/.xlsm) — je Produkt eine Datei, oder ein .zip mit vielen Dateien",
+                         type=["xlsx","xlsm","zip"], accept_multiple_files=True)
 if not files:
     st.info("Bitte laden Sie eine oder mehrere Excel-Dateien hoch.")
     st.stop()
 
-products = {}
-errors = []
-for f in files:
-    try:
-        xls = pd.ExcelFile(f)
-        H1,H2 = parse_cost_structure(xls)
-        TECH = parse_tech(xls)
-        # attach tech to H2
-        if not TECH.empty and not H2.empty:
-            H2 = H2.merge(TECH, on="H2", how="left")
-        products[f.name] = Product(f.name, H1, H2, TECH)
-    except Exception as e:
-        errors.append(f"{f.name}: {e}")
+os.makedirs(SPOOL_DIR, exist_ok=True)
+_sweep_spool()
+job, early = ingest_job(), []
+
+def parse_early(item, n):
+    """Full parses start as members are spooled, unless this upload is (or, on the
+    first run, will be by default) parsed on demand."""
+    was_lazy = st.session_state.get("lazy_parse")
+    if not job.cancelled and not (n >= LAZY_FROM if was_lazy is None else was_lazy):
+        job.submit(item[2], item[3], item[1]); early.append(item[2])
+
+items, errors = spool_uploads(files, parse_early)
+lazy = st.toggle("Produkte erst bei Bedarf parsen", value=len(items) >= LAZY_FROM,
+                 help="Nur die angesehenen Produkte werden vollständig eingelesen – spart Zeit bei vielen Dateien.")
+st.session_state["lazy_parse"] = lazy
+if lazy and early:
+    job.cancel(early)   # the batch turned out large: whatever has not started waits for demand
+products, overview, pending, parse_errors = ingest(items, lazy)
+errors += parse_errors
+
+@st.fragment(run_every=1.0)
+def parse_progress(keys, n_pending):
+    """Polls the background parses; a full rerun shows each newly finished file."""
+    job = st.session_state["ingest_job"]
+    done, total, running, eta = job.progress(keys)
+    if total - done < n_pending:
+        st.rerun()
+    text = f"Vollständiges Parsen: {done}/{total} Dateien fertig"
+    if running: text += f" • läuft: {', '.join(running)}"
+    if eta is not None: text += f" • noch ca. {eta:.0f} s"
+    st.progress(done / total, text=text)
+    if st.button("Abbrechen", key="cancel_ingest"):
+        job.cancel()
+        st.rerun()
+
+with st.expander("Schnellübersicht", expanded=bool(pending) or not any(P.loaded for P in products.values())):
+    st.dataframe(overview, use_container_width=True, hide_index=True)
+if pending:
+    parse_progress([x[2] for x in items], len(pending))
+elif st.session_state["ingest_job"].cancelled and not lazy and (overview["Status"] == "abgebrochen").any():
+    if st.button("Einlesen fortsetzen"):
+        st.session_state["ingest_job"].cancelled = False
+        st.rerun()
 
 if errors:
     with st.expander("Parsing-Hinweise", expanded=True):
         for m in errors: st.error(m)
+with st.expander("Cache-Statistik"):
+    st.write({"Speicher": parse_cache().stats(),
+              "Disk": disk_store().stats() if disk_store() is not None else "aus (FKA_DISK_CACHE nicht gesetzt)"})
 if not products:
     st.stop()
 
+generic = [P for P in products.values() if P.loaded and P.layout == "generic" and not P.error]
+if generic:
+    with st.expander("Kostenspalten (generische Vorlage)"):
+        st.caption("Automatisch erkannte Kostenspalten; bei Bedarf manuell anpassen.")
+        for P in generic:
+            cols, detected = cached(f"columns:{P.key}", lambda: generic_columns(P.path))
+            chosen = st.multiselect(P.name, cols, default=[c for c in detected if c in cols], key=f"costcols_{P.key}")
+            if chosen != detected:
+                h = hashlib.sha1("\x1f".join(chosen).encode("utf-8")).hexdigest()
+                H1,H2,TECH,layout = cached(f"product:{P.key}:cols:{h}", lambda: parse_generic_override(P.path, chosen))
+                products[P.name] = Product(P.name, H1, H2, TECH, key=f"{P.key}:cols:{h}", layout=layout, path=P.path)
+
+base_products = dict(products)
+whatif = st.session_state.setdefault("whatif", {})
+for n, delta in whatif.items():
+    if n in products and any(delta.values()):
+        products[n] = apply_delta(products[n], delta)
+if any(any(d.values()) for n, d in whatif.items() if n in products):
+    c1, c2 = st.columns([4, 1])
+    c1.warning(f"Was-wäre-wenn aktiv: {', '.join(n for n, d in whatif.items() if n in products and any(d.values()))}")
+    if c2.button("Zurücksetzen", key="whatif_reset"):
+        whatif.clear(); st.rerun()
+
 names = list(products.keys())
+flow = Dataflow(st.session_state.setdefault("dataflow", {}))
 
-tab1, tab2, tab3, tab4 = st.tabs(["Funktionsmatrix", "Funktionenkosten", "Technik Bewertung", "Top Kostenabweichung"])
+tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs(["Funktionsmatrix", "Funktionenkosten", "Technik Bewertung", "Top Kostenabweichung",
+                                                          "Was-wäre-wenn", "Simulation", "Zielkosten", "Best-in-Class"])
 
 # ---------------- Tab 1: Funktionsmatrix ----------------
 with tab1:
     sel = st.selectbox("Produkt wählen", names, index=0)
     P = products[sel]
     H1, H2 = P.H1.copy(), P.H2.copy()
+    if P.error: st.error(f"{P.name}: {P.error}")
+    st.caption(f"Layout: {P.layout or 'nicht erkannt'}")
     st.caption("Kacheln mit Rahmen (ohne Füllfarbe). Gelbes Badge = H1-Gewichtung (Zeile 4). Rechts in jeder H2-Kachel: H2-Gewichtung (Zeile 5).")
 
     if H1.empty:
@@ -191,57 +2216,64 @@ with tab1:
 with tab2:
     sel2 = st.selectbox("Produkt wählen ", names, index=0, key="costprod")
     P = products[sel2]; H1,H2 = P.H1.copy(), P.H2.copy()
+    if P.error: st.error(f"{P.name}: {P.error}")
 
     st.subheader("Kosten je Hauptfunktion (Zeile 7)")
     if H1.empty:
         st.info("Keine H1-Kosten vorhanden.")
     else:
-        fig = go.Figure(go.Bar(x=H1["H1"], y=H1["H1Cost"], marker_color="#1F5AA6", width=0.35))
-        fig.update_layout(height=340, margin=dict(l=20,r=20,t=20,b=80), yaxis_title="Kosten Hauptfunktion")
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(flow.node("costs.h1", fig_h1_costs, P).value, use_container_width=True)
 
     st.subheader("Drilldown: Kosten je Nebenfunktion (Zeile 8)")
     if H2.empty:
         st.info("Keine H2-Kosten vorhanden.")
     else:
-        # color by H1
-        h1_list = H1["H1"].tolist()
-        cmap_colors = ["#1F5AA6","#F28C28","#0B3C7A","#FFB347","#8A8A8A","#D46A00","#B3B3B3"]
-        cmap = {h: cmap_colors[i%len(cmap_colors)] for i,h in enumerate(h1_list)}
-        H2c = H2.copy()
-        H2c["Color"] = H2c["H1"].map(cmap)
-        fig2 = go.Figure(go.Bar(x=H2c["H2"], y=H2c["H2Cost"], marker_color=H2c["Color"], width=0.35))
-        fig2.update_layout(height=420, margin=dict(l=20,r=20,t=10,b=140), yaxis_title="Kosten Nebenfunktion")
-        fig2.update_xaxes(tickangle=45)
-        st.plotly_chart(fig2, use_container_width=True)
+        st.plotly_chart(flow.node("costs.h2", fig_h2_costs, P).value, use_container_width=True)
 
 # ---------------- Tab 3: Technik Bewertung ----------------
 with tab3:
     st.subheader("Technische Bewertung – Nebenfunktionen (H2)")
-    # union axis
-    all_h2 = sorted(set(h2 for P in products.values() for h2 in P.H2["H2"].astype(str).tolist()))
-    if not all_h2:
-        st.info("Keine H2 gefunden.")
+    missing = sum(not P.loaded for P in products.values())
+    if lazy and missing and not st.toggle("Alle Produkte laden", key="load_all"):
+        st.info(f"Die Portfolio-Ansicht braucht alle Produkte ({missing} noch nicht geparst); sie werden beim Laden parallel geparst.")
     else:
-        figt = go.Figure()
-        palette = ["#1F5AA6","#F28C28","#0B3C7A","#FFB347","#8A8A8A","#D46A00","#B3B3B3","#6AA6FF","#FF8C66"]
-        for i,(n,P) in enumerate(products.items()):
-            ser = dict(P.H2[["H2","TechScore"]].dropna().values)
-            y = [ser.get(h2, np.nan) for h2 in all_h2]
-            figt.add_scatter(x=all_h2, y=y, mode="lines+markers", name=n, line=dict(color=palette[i%len(palette)], width=2))
-        figt.update_layout(height=380, margin=dict(l=20,r=20,t=10,b=160), yaxis_title="TechScore")
-        figt.update_xaxes(tickangle=45)
-        st.plotly_chart(figt, use_container_width=True)
-
-        st.subheader("Kosten (H2) – alle Produkte (Linien)")
-        figk = go.Figure()
-        for i,(n,P) in enumerate(products.items()):
-            ser = dict(P.H2[["H2","H2Cost"]].dropna().values)
-            y = [ser.get(h2, np.nan) for h2 in all_h2]
-            figk.add_scatter(x=all_h2, y=y, mode="lines+markers", name=n, line=dict(color=palette[i%len(palette)], width=2, dash="dot"))
-        figk.update_layout(height=360, margin=dict(l=20,r=20,t=10,b=160), yaxis_title="Kosten (H2)")
-        figk.update_xaxes(tickangle=45)
-        st.plotly_chart(figk, use_container_width=True)
+        load_all(products.values())
+        pairs = tuple(products.items())
+        all_h2 = flow.node("portfolio.axis", portfolio_axis, pairs)
+        if not all_h2.value:
+            st.info("Keine H2 gefunden.")
+        else:
+            figt = flow.node("portfolio.tech", fig_portfolio_lines, pairs, all_h2, "TechScore", "TechScore", 380)
+            st.plotly_chart(figt.value, use_container_width=True)
+
+            st.subheader("Kosten (H2) – alle Produkte (Linien)")
+            figk = flow.node("portfolio.cost", fig_portfolio_lines, pairs, all_h2, "H2Cost", "Kosten (H2)", 360, "dot")
+            st.plotly_chart(figk.value, use_container_width=True)
+
+        st.subheader("Technische Bewertung – Hauptfunktionen (H1)")
+        scores = flow.node("portfolio.tech_h1", portfolio_scores, tuple(base_products.items()), pairs)
+        if scores.value["TechMean"].notna().any():
+            metric = st.radio("Kennzahl", ["TechWeighted","TechNorm","TechMean"], horizontal=True,
+                              format_func={"TechWeighted":"gewichtet (Σ Score × Gewicht)","TechNorm":"normiert (Σ Score × Gewicht / Σ Gewicht)","TechMean":"Mittelwert"}.get)
+            st.plotly_chart(flow.node("portfolio.tech_h1.fig", fig_tech_h1, scores, metric).value, use_container_width=True)
+            st.dataframe(scores.value, use_container_width=True, hide_index=True)
+
+            st.subheader("Pareto-Front – Kosten vs. gewichtete Bewertung")
+            pareto = flow.node("portfolio.pareto", pareto_points, pairs, scores)
+            h1_pts = pareto.value[1]
+            if h1_pts is None:
+                st.info("Keine H1-Kosten vorhanden.")
+            else:
+                view = st.radio("Ebene", ["Produkte", "Hauptfunktion"], horizontal=True, key="pareto_level")
+                h1_pick = None if view == "Produkte" else st.selectbox("Hauptfunktion", h1_pts["H1"].drop_duplicates().tolist(), key="pareto_h1")
+                pv = flow.node("portfolio.pareto.view", pareto_view, pareto, h1_pick)
+                pts, cost = pv.value
+                st.plotly_chart(flow.node("portfolio.pareto.fig", lambda v: fig_pareto(*v, "Produkt"), pv).value, use_container_width=True)
+                st.caption(f"{int((~pts['Dominiert'] & pts[cost].notna() & pts['TechWeighted'].notna()).sum())} nicht dominiert, "
+                           f"{int(pts['Dominiert'].sum())} dominiert.")
+                st.dataframe(pts.sort_values(["Dominiert", cost]), use_container_width=True, hide_index=True)
+        else:
+            st.info("Keine technischen Bewertungen vorhanden.")
 
 # ---------------- Tab 4: Top Kostenabweichung ----------------
 with tab4:
@@ -252,23 +2284,142 @@ with tab4:
         st.info("Bitte zwei unterschiedliche Produkte wählen.")
     else:
         A, B = products[a], products[b]
-        sA = A.H2.set_index("H2")["H2Cost"]
-        sB = B.H2.set_index("H2")["H2Cost"]
-        idx = sorted(set(sA.index)|set(sB.index))
-        rows = []
-        for key in idx:
-            ca = float(sA.get(key, np.nan)) if key in sA else np.nan
-            cb = float(sB.get(key, np.nan)) if key in sB else np.nan
-            if np.isnan(ca) and np.isnan(cb): continue
-            delta = (0 if np.isnan(ca) else ca) - (0 if np.isnan(cb) else cb)
-            rows.append([key, ca, cb, delta, abs(delta)])
-        dd = pd.DataFrame(rows, columns=["H2","Cost_A","Cost_B","Delta","AbsDelta"]).sort_values("AbsDelta", ascending=False)
-        top10 = dd.head(10)
-        figd = go.Figure(go.Bar(x=top10["H2"], y=top10["AbsDelta"], marker_color="#1F5AA6", width=0.35))
-        figd.update_layout(height=380, margin=dict(l=20,r=20,t=10,b=160), yaxis_title="|Delta|")
-        figd.update_xaxes(tickangle=45)
-        st.plotly_chart(figd, use_container_width=True)
+        dev = flow.node("deviation", lambda A, B: cached(f"deviation:{A.key}:{B.key}", lambda: deviation_table(A, B)), A, B)
+        st.plotly_chart(flow.node("deviation.fig", fig_top_deviation, dev).value, use_container_width=True)
         st.markdown("**Ranking – größte Abweichungen (H2)**")
-        st.dataframe(dd[["H2","Cost_A","Cost_B","Delta"]].reset_index(drop=True), use_container_width=True)
+        st.dataframe(dev.value[["H2","Cost_A","Cost_B","Delta"]].reset_index(drop=True), use_container_width=True)
+
+# ---------------- Tab 5: Was-wäre-wenn ----------------
+with tab5:
+    st.subheader("Was-wäre-wenn – Gewichtungen und Kosten überschreiben")
+    st.caption("Änderungen gelten in allen Ansichten, bis sie zurückgesetzt werden. Leere Zelle = Wert aus der Datei.")
+    sel5 = st.selectbox("Produkt wählen  ", names, index=0, key="whatif_prod")
+    P, B = products[sel5], base_products[sel5]
+    t1 = pd.DataFrame({"H1": P.H1["H1"], "Gewicht %": P.H1["H1Weight"]*100})
+    st.data_editor(t1, key=f"wi_h1_{sel5}", hide_index=True, use_container_width=True, disabled=["H1"],
+                   on_change=store_whatif_edits, args=(sel5, "H1", f"wi_h1_{sel5}", t1))
+    t2 = pd.DataFrame({"H1": P.H2["H1"], "H2": P.H2["H2"], "Gewicht %": P.H2["H2Weight"]*100, "Kosten": P.H2["H2Cost"]})
+    st.data_editor(t2, key=f"wi_h2_{sel5}", hide_index=True, use_container_width=True, disabled=["H1","H2"],
+                   on_change=store_whatif_edits, args=(sel5, "H2", f"wi_h2_{sel5}", t2))
+    if P is not B:
+        st.markdown("**Auswirkung je Hauptfunktion**")
+        S0, S = (flow.node(f"whatif.tech_h1.{i}", lambda X: tech_scores([(sel5, X)]), X).value for i, X in enumerate((B, P)))
+        # apply_delta keeps the H1 rows in place, so before/after line up by position
+        # (a label may open several blocks); tech scores are per label
+        tech = lambda X: B.H1["H1"].map(X.drop_duplicates("H1").set_index("H1")["TechWeighted"]).to_numpy()
+        imp = pd.DataFrame({"H1": B.H1["H1"].to_numpy(), "Kosten vorher": B.H1["H1Cost"].to_numpy(),
+                            "Kosten nachher": P.H1["H1Cost"].to_numpy(), "Tech vorher": tech(S0), "Tech nachher": tech(S)})
+        st.dataframe(imp, use_container_width=True, hide_index=True)
+
+    st.markdown("---")
+    st.subheader("Szenarien")
+    store = ScenarioStore(st.session_state.setdefault("scenarios", {}))
+    c1, c2 = st.columns([3, 1])
+    new_name = c1.text_input("Name", placeholder="z. B. Design-to-cost A", key="scenario_name")
+    if c2.button("Als Szenario speichern", disabled=not new_name.strip() or not any(any(d.values()) for d in whatif.values())):
+        store.save(new_name.strip(), whatif); st.rerun()
+    if store.names():
+        c1, c2, c3 = st.columns([3, 1, 1])
+        pick = c1.selectbox("Szenario", store.names(), key="scenario_pick")
+        if c2.button("Laden", help="Übernimmt das Szenario in die Was-wäre-wenn-Änderungen"):
+            whatif.clear(); whatif.update(store.deltas(pick)); st.rerun()
+        if c3.button("Löschen"):
+            store.delete(pick); st.rerun()
+        ready = {n: P for n, P in base_products.items() if P.loaded}
+        chosen = st.multiselect("Vergleichen", store.names(), default=store.names(), key="scenario_compare")
+        if len(ready) < len(base_products):
+            st.caption(f"Vergleich über die {len(ready)} bereits geparsten Produkte.")
+        if chosen and ready:
+            cmp = flow.node("scenarios.compare", lambda names, _: compare_scenarios(store, names, ready),
+                            tuple(chosen), (tuple(ready.items()), tuple(store.token(n) for n in chosen)))
+            st.plotly_chart(flow.node("scenarios.fig", fig_scenarios, cmp).value, use_container_width=True)
+            st.dataframe(cmp.value.pivot(index="Produkt", columns="Szenario", values=["Kosten","Tech"])
+                         .reindex(columns=["Basis", *chosen], level=1), use_container_width=True)
+
+# Portfolio tabs: only taken after tabs 1-5, so products those tabs parsed in this run count
+parsed = tuple((n, P) for n, P in products.items() if P.loaded)
+target = flow.node("target", lambda pairs: cached(f"target:{portfolio_key(pairs)}", lambda: target_costing(pairs)), parsed)
+
+# ---------------- Tab 6: Simulation ----------------
+with tab6:
+    st.subheader("Monte-Carlo-Simulation – Kostenunsicherheit")
+    st.caption("H2-Kosten und Tech-Scores werden je Ziehung um ± Streuung variiert; gleicher Seed = gleiche Ergebnisse.")
+    with st.form("mc_form"):
+        c1, c2, c3, c4, c5 = st.columns(5)
+        dist = c1.radio("Verteilung", ["uniform", "triangular"], format_func={"uniform":"± % gleichverteilt","triangular":"Dreieck"}.get)
+        cost_spread = c2.number_input("Kosten ± %", 0.0, 100.0, 10.0, 1.0)
+        score_spread = c3.number_input("Tech-Score ± %", 0.0, 100.0, 10.0, 1.0)
+        n_draws = c4.select_slider("Ziehungen", [1000, 2000, 5000, 10000, 20000], value=5000)
+        seed = c5.number_input("Seed", 0, 2**31 - 1, 42, 1)
+        if st.form_submit_button("Simulieren"):
+            st.session_state["mc_run"] = True
+    ready = parsed
+    if not st.session_state.get("mc_run"):
+        st.info("Parameter wählen und „Simulieren“ starten.")
+    elif not ready:
+        st.info("Noch keine Produkte geparst.")
+    else:
+        if len(ready) < len(products):
+            st.caption(f"Simulation über die {len(ready)} bereits geparsten Produkte.")
+        params = (int(n_draws), cost_spread / 100, score_spread / 100, dist, int(seed), (a, b))
+        mc = flow.node("mc", lambda pairs, params: cached(f"mc:{portfolio_key(pairs)}:{params!r}", lambda: monte_carlo(pairs, *params)),
+                       ready, params)
+        if mc.value is None:
+            st.info("Keine H2-Daten vorhanden.")
+        else:
+            st.markdown("**Gesamtbewertung je Produkt (Ø gewichteter H1-Score)**")
+            st.dataframe(mc.value["score"], use_container_width=True, hide_index=True)
+            st.markdown("**Kosten je Hauptfunktion**")
+            sel6 = st.selectbox("Produkt wählen   ", [n for n, _ in ready], key="mc_prod")
+            fig6 = flow.node("mc.fig", lambda mc, n: fig_mc_h1(mc["h1"][mc["h1"]["Produkt"].eq(n)]), mc, sel6)
+            st.plotly_chart(fig6.value, use_container_width=True)
+            st.dataframe(mc.value["h1"], use_container_width=True, hide_index=True)
+            if mc.value["rank"] is not None:
+                st.markdown(f"**Rang der Top-Abweichungen {a} vs. {b} (Auswahl aus Tab 4)**")
+                st.dataframe(mc.value["rank"], use_container_width=True, hide_index=True)
+
+# ---------------- Tab 7: Zielkosten ----------------
+with tab7:
+    st.subheader("Zielkostenkontrolldiagramm – Kostenanteil vs. Gewichtsanteil")
+    st.caption("Wertindex = Gewichtsanteil / Kostenanteil. Funktionen außerhalb der Zone sind zu teuer bzw. zu günstig für ihre Bedeutung.")
+    if len(parsed) < len(products):
+        st.caption(f"Auswertung über die {len(parsed)} bereits geparsten Produkte.")
+    c1, c2 = st.columns([1, 3])
+    level = c1.radio("Ebene", ["H1", "H2"], horizontal=True, key="target_level")
+    q = c1.number_input("Zone q (%-Punkte)", 1.0, 50.0, 10.0, 1.0, key="target_q")
+    pick7 = c2.multiselect("Produkte", [n for n, _ in parsed], default=[n for n, _ in parsed][:10], key="target_prod")
+    T = target.value[target.value["Ebene"].eq(level) & target.value["Produkt"].isin(pick7)]
+    if T["Gewichtsanteil"].notna().any():
+        fig7 = flow.node("target.fig", lambda T, level, pick, q: fig_target_chart(T[T["Ebene"].eq(level) & T["Produkt"].isin(pick)], q),
+                         target, level, tuple(pick7), q)
+        st.plotly_chart(fig7.value, use_container_width=True)
+    else:
+        st.info("Keine Gewichtungen vorhanden.")
+    zone = target_zone(T, q)
+    flagged = T.assign(Zone=zone)[zone.isin(["zu teuer", "zu günstig"])].sort_values("Wertindex", kind="stable")
+    st.markdown(f"**Funktionen außerhalb der Zielkostenzone ({len(flagged)} von {int(zone.ne('–').sum())})**")
+    st.dataframe(flagged, use_container_width=True, hide_index=True)
+
+# ---------------- Tab 8: Best-in-Class ----------------
+with tab8:
+    st.subheader("Best-in-Class je Nebenfunktion (H2)")
+    st.caption("Günstigste nachgewiesene Kosten je H2 bei ausreichender technischer Bewertung; Lücke = eigene Kosten − Best-in-Class.")
+    if len(parsed) < len(products):
+        st.caption(f"Auswertung über die {len(parsed)} bereits geparsten Produkte.")
+    bench = flow.node("bench.index", lambda pairs: cached(f"bench:{portfolio_key(pairs)}", lambda: benchmark_index(pairs)), parsed)
+    if bench.value is None or not len(bench.value["key"]):
+        st.info("Keine H2 mit Kosten und TechScore vorhanden.")
+    else:
+        t_lo, t_hi = bench.value["tech_range"]
+        threshold = st.slider("Mindest-TechScore", t_lo, max(t_hi, t_lo + 1.0), t_lo, key="bench_threshold")
+        res = flow.node("bench", benchmark, bench, threshold)
+        per_h2, rows = res.value
+        st.markdown("**Einsparpotenzial je H2 (Summe der Lücken aller Produkte)**")
+        st.dataframe(per_h2, use_container_width=True, hide_index=True)
+        st.markdown("**Einsparpotenzial je Produkt**")
+        st.dataframe(rows.groupby("Produkt", sort=False)["Einsparung"].sum().sort_values(ascending=False).reset_index(),
+                     use_container_width=True, hide_index=True)
+        h2_pick = st.selectbox("Nebenfunktion", per_h2["H2"], key="bench_h2")
+        st.dataframe(rows[rows["H2"].eq(h2_pick)].sort_values("H2Cost"), use_container_width=True, hide_index=True)
 
 st.caption(f"© EFESO • Version {VERSION} • Vorlage für Funktions- & Kostenanalyse")
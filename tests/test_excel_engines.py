@@ -0,0 +1,86 @@
+"""calamine must read the templates cell for cell like openpyxl (FKA_EXCEL_ENGINE).
+
+Run: python -m pytest tests (needs python-calamine, otherwise skipped)."""
+import pathlib
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+pytest.importorskip("python_calamine")
+
+APP = pathlib.Path(__file__).resolve().parents[1] / "app_v10_5.py"
+
+
+@pytest.fixture(scope="module")
+def app():
+    """Namespace of app_v10_5.py up to its UI - the rest renders the page."""
+    src = APP.read_text(encoding="utf-8")
+    ns = {"__name__": "app_v10_5"}
+    exec(compile(src[:src.index("# ---------------- UI ----------------")], str(APP), "exec"), ns)
+    return ns
+
+
+@pytest.fixture(scope="module")
+def workbook(tmp_path_factory):
+    """Cost / tech / Funktionsbaum / START sheets with the cell kinds the parsers meet:
+    text, umlauts, ints, floats, percent and German-number strings, bools, gaps."""
+    wb = Workbook()
+    ws = wb.active; ws.title = "SLAVE_START"
+    for i, (k, v) in enumerate([("Produkt", "Pumpe A"), ("Kunde", "ACME GmbH"), ("Stückzahl", 1200), ("Aktiv", True)], 1):
+        ws.cell(i, 1, k); ws.cell(i, 2, v)
+    ws = wb.create_sheet("SLAVE_Funktions-Kostenstruktur")
+    ws.cell(1, 1, "Struktur"); ws.cell(7, 1, "Kosten H1"); ws.cell(8, 1, "Kosten H2")
+    col, values = 9, [17, 1.5e-3, "1.234,50", -2.25, 1e6]
+    for h1, h2s in [("Abdichten", ["Dichtung halten", "Medium trennen"]), ("Führen", ["Welle führen", "Lager aufnehmen", "Spiel"])]:
+        ws.cell(4, col, "30%"); ws.cell(7, col, 123.45)
+        for j, h2 in enumerate(h2s):
+            ws.cell(1, col, h1); ws.cell(2, col, h2)
+            ws.cell(5, col, 0.333 if j else 0.5)
+            ws.cell(8, col, values[col - 9])
+            col += 1
+    ws.cell(12, col + 2, "Notiz")                      # stray cell after a gap
+    ws = wb.create_sheet("SLAVE_Techn.Bewertung")
+    for r, (h2, score) in enumerate([("Dichtung halten", 7.5), ("Welle führen", 3), ("Spiel", "n/a")], 6):
+        ws.cell(r, 2, h2); ws.cell(r, 12, 20); ws.cell(r, 18, score)
+    ws = wb.create_sheet("Funktionsbaum")
+    ws.cell(3, 2, "Abdichten"); ws.cell(3, 3, "Führen"); ws.cell(5, 2, "40%"); ws.cell(5, 3, 0.6)
+    path = tmp_path_factory.mktemp("engines") / "template.xlsx"
+    wb.save(path)
+    return path
+
+
+def read_all(app, path, engine):
+    app["EXCEL_ENGINES"] = [engine]
+    xls = app["ExcelReader"](str(path))
+    assert xls.engine == engine
+    return {s: xls.parse(s, header=None, dtype=object) for s in xls.sheet_names}
+
+
+def test_calamine_matches_openpyxl(app, workbook):
+    fast, ref = read_all(app, workbook, "calamine"), read_all(app, workbook, "openpyxl")
+    assert list(fast) == list(ref)
+    for sheet in ref:
+        pd.testing.assert_frame_equal(fast[sheet], ref[sheet], obj=sheet)
+        pd.testing.assert_frame_equal(fast[sheet].map(type), ref[sheet].map(type), obj=f"{sheet} (cell types)")
+
+
+def test_fast_path_reads_dates(app, tmp_path):
+    """LazyWorkbook.read_sheet (quick scan) returns date and time cells as the engines do."""
+    import datetime as dt
+    import zipfile
+    wb = Workbook()
+    ws = wb.active; ws.title = "SLAVE_START"
+    rows = [("Datum", dt.date(2024, 3, 1)), ("Uhrzeit", dt.time(12, 30)), ("Stand", dt.datetime(2024, 3, 1, 12, 30)),
+            ("Frist", 45352), ("Anteil", 0.5), ("Stückzahl", 1200)]
+    for i, (k, v) in enumerate(rows, 1):
+        ws.cell(i, 1, k); ws.cell(i, 2, v)
+    ws["B4"].number_format = "dd.mm.yyyy"; ws["B5"].number_format = "0%"
+    path = tmp_path / "start.xlsx"
+    wb.save(path)
+    with zipfile.ZipFile(path) as zf:
+        lazy = app["LazyWorkbook"](str(path), str(path), app["workbook_parts"](zf))
+    fast = lazy.read_sheet("SLAVE_START")
+    ref = read_all(app, path, "openpyxl")["SLAVE_START"]
+    assert fast.values.tolist() == ref.values.tolist()
+    assert [type(v).__name__ for v in fast[1]] == ["Timestamp", "time", "Timestamp", "Timestamp", "float", "int"]